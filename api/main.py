@@ -1,14 +1,42 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 import os
-import uvicorn
 
 from routers import files, database, analytics, templates
+from services.graph_client import get_graph
+from services.duckdb_client import DUCKDB_PATH, duckdb_conn
+
+
+def init_database():
+    """Table set, upload-log sequence and derived tables — one connection, closed before serving"""
+    os.makedirs(os.path.dirname(DUCKDB_PATH), exist_ok=True)
+    with duckdb_conn() as conn:
+        tables = {t[0] for t in conn.execute("SHOW TABLES").fetchall()}
+        files.init_upload_log(conn, tables)
+        analytics.refresh_derived_tables(conn, tables)
+    return tables
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup state only — DuckDB is opened per request/write (see services.duckdb_client)"""
+    app.state.tables = await asyncio.to_thread(init_database)
+    try:
+        get_graph(app)
+    except Exception as e:
+        print(f"FalkorDB not reachable at startup, will connect on first use: {e}")
+    app.state.write_lock = asyncio.Lock()
+    app.state.data_version = 0  # bumped on every write; part of the analytics cache key
+    yield
+
 
 app = FastAPI(
     title="WC Optimizer API",
     description="Working Capital & Inventory Optimization API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS
@@ -42,6 +70,3 @@ def root():
             "templates": "/api/templates"
         }
     }
-
-if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
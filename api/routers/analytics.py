@@ -1,178 +1,212 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-import os
-import duckdb
 
-router = APIRouter()
-
-DUCKDB_PATH = os.getenv("DUCKDB_PATH", "/data/supply_chain.duckdb")
+from services.query_cache import cached
+from services.duckdb_client import duckdb_conn
+from services.responses import FastJSONResponse
 
+router = APIRouter()
 
-def get_duckdb():
-    os.makedirs(os.path.dirname(DUCKDB_PATH), exist_ok=True)
-    return duckdb.connect(DUCKDB_PATH)
-
-
-def table_exists(conn, name):
-    try:
-        return name in [t[0] for t in conn.execute("SHOW TABLES").fetchall()]
-    except Exception:
-        return False
+# Per-SKU rollup of the legacy `sales` table (scripts/init_db.py), rebuilt on startup and on /refresh
+# so dashboard polls scan a few hundred rows instead of the raw sales fact table. Uploads never write
+# `sales` — they land in the DATASETS.md category tables — so there is nothing to rebuild per upload
+SALES_SKU_AGG_SQL = """
+CREATE OR REPLACE TABLE sales_sku_agg AS
+SELECT sku, SUM(revenue) as total_revenue, SUM(quantity) as units_sold,
+    STDDEV(quantity) as qty_std, AVG(quantity) as qty_avg
+FROM sales GROUP BY sku
+"""
+
+# ABC-XYZ over every SKU, materialized alongside the rollup; variability_score is the
+# coefficient of variation that DuckDBService.get_abc_xyz_classification reads
+ABC_XYZ_CLASSIFICATION_SQL = """
+CREATE OR REPLACE TABLE abc_xyz_classification AS
+WITH ranked AS (
+    SELECT *, total_revenue / SUM(total_revenue) OVER () * 100 as revenue_pct,
+        SUM(total_revenue) OVER (ORDER BY total_revenue DESC) / SUM(total_revenue) OVER () * 100 as cum_pct,
+        CASE WHEN qty_avg > 0 THEN qty_std / qty_avg ELSE 0 END as cv
+    FROM sales_sku_agg
+)
+SELECT sku, ROUND(total_revenue, 2) as revenue, ROUND(revenue_pct, 2) as revenue_pct,
+    CASE WHEN cum_pct <= 80 THEN 'A' WHEN cum_pct <= 95 THEN 'B' ELSE 'C' END as abc_class,
+    CASE WHEN cv < 0.5 THEN 'X' WHEN cv < 1.0 THEN 'Y' ELSE 'Z' END as xyz_class,
+    cv as variability_score
+FROM ranked
+"""
+
+# Derived tables in build order with the table each is built from
+DERIVED_TABLES = [
+    ("sales_sku_agg", SALES_SKU_AGG_SQL, "sales"),
+    ("abc_xyz_classification", ABC_XYZ_CLASSIFICATION_SQL, "sales_sku_agg"),
+]
+DERIVED_TABLE_NAMES = frozenset(name for name, _, _ in DERIVED_TABLES)
+
+# Fixed analytics SQL — variable parts (days, limit) are bound parameters.
+# revenue/unit_cost are DECIMAL in scripts/init_db.py; cast so Python gets floats, not Decimals
+KPI_SQL = """
+WITH s AS (SELECT SUM(revenue)::DOUBLE as tot_rev, COUNT(DISTINCT date) as dts FROM sales),
+     i AS (SELECT SUM(qty_on_hand * unit_cost)::DOUBLE as inv_val FROM inventory)
+SELECT i.inv_val, s.tot_rev, s.dts FROM s, i
+"""
+
+ABC_XYZ_SQL = """
+SELECT sku, revenue, revenue_pct, abc_class, xyz_class
+FROM abc_xyz_classification ORDER BY revenue DESC LIMIT 100
+"""
+
+REORDER_SQL = """
+SELECT sku, qty_on_hand, reorder_point,
+    CASE WHEN qty_on_hand < reorder_point THEN 'critical'
+         WHEN qty_on_hand < reorder_point * 1.2 THEN 'warning' ELSE 'ok' END as status
+FROM inventory
+WHERE qty_on_hand < reorder_point * 1.2
+ORDER BY CAST(qty_on_hand AS FLOAT) / NULLIF(reorder_point, 0) ASC
+"""
+
+REORDER_COUNTS_SQL = """
+SELECT COUNT(*) FILTER (WHERE qty_on_hand < reorder_point),
+    COUNT(*) FILTER (WHERE qty_on_hand >= reorder_point AND qty_on_hand < reorder_point * 1.2)
+FROM inventory
+"""
+
+DEAD_STOCK_SQL = """
+WITH last_sale AS (SELECT sku, MAX(date) as last_sale_date FROM sales GROUP BY sku)
+SELECT i.sku, i.qty_on_hand, i.unit_cost,
+    COALESCE(i.qty_on_hand * i.unit_cost, 0) as value_at_risk,
+    l.last_sale_date
+FROM inventory i LEFT JOIN last_sale l ON i.sku = l.sku
+WHERE l.last_sale_date IS NULL OR l.last_sale_date < CURRENT_DATE - CAST(? AS INTEGER)
+ORDER BY value_at_risk DESC
+"""
+
+TOP_SKUS_SQL = """
+SELECT sku, total_revenue as revenue, units_sold
+FROM sales_sku_agg ORDER BY revenue DESC LIMIT ?
+"""
+
+
+def fetch_records(cursor) -> List[Dict[str, Any]]:
+    """Rows of an executed query as dicts via Arrow — skips the pandas DataFrame round-trip"""
+    tbl = cursor.to_arrow_table() if hasattr(cursor, "to_arrow_table") else cursor.fetch_arrow_table()
+    return tbl.to_pylist()
+
+
+def refresh_derived_tables(conn, tables):
+    """Rebuild summary tables whose source exists — caller holds the write lock"""
+    for name, sql, source in DERIVED_TABLES:
+        if source in tables:
+            conn.execute(sql)
+            tables.add(name)
+
+
+def table_exists(request: Request, name):
+    """Lookup in the table set cached at startup and kept current by /upload and /reset"""
+    return name in request.app.state.tables
 
 
 @router.get("/kpi/summary")
-async def get_kpi_summary():
+@cached
+def get_kpi_summary(request: Request):
     """Get key KPIs: CCC, DIO, DSO, DPO — computed from real data"""
-    conn = get_duckdb()
     result = {"period": "all_time", "unit": "days", "formula": "CCC = DIO + DSO - DPO"}
 
-    if not table_exists(conn, "sales") and not table_exists(conn, "inventory"):
-        conn.close()
+    if not table_exists(request, "sales") and not table_exists(request, "inventory"):
         return {"message": "No data uploaded yet. Upload sales and inventory data to see KPIs."}
 
-    # DIO
+    # DIO — one round-trip, one scan of sales and inventory
+    result["dio"] = 0
     try:
-        if table_exists(conn, "inventory") and table_exists(conn, "sales"):
-            row = conn.execute("""
-                SELECT
-                    COALESCE(SUM(i.qty_on_hand * i.unit_cost), 0),
-                    COALESCE((SELECT SUM(revenue) / NULLIF(COUNT(DISTINCT date), 0) FROM sales), 1)
-                FROM inventory i
-            """).fetchone()
-            result["dio"] = round(row[0] / row[1], 1) if row[1] > 0 else 0
-        else:
-            result["dio"] = 0
+        if table_exists(request, "inventory") and table_exists(request, "sales"):
+            with duckdb_conn() as conn:
+                inv_val, tot_rev, dts = conn.execute(KPI_SQL).fetchone()
+            daily_rev = tot_rev / dts if tot_rev is not None and dts else 1
+            result["dio"] = round((inv_val or 0) / daily_rev, 1) if daily_rev > 0 else 0
     except Exception:
         result["dio"] = 0
 
-    # DSO — simplified (total revenue / daily revenue * assumed 30-day cycle)
-    try:
-        if table_exists(conn, "sales"):
-            row = conn.execute("SELECT SUM(revenue), COUNT(DISTINCT date) FROM sales").fetchone()
-            total, days = row[0] or 0, row[1] or 1
-            result["dso"] = round(30.0, 1)  # simplified — full DSO needs AR data
-            result["dso_note"] = "Simplified — full DSO needs accounts receivable data"
-        else:
-            result["dso"] = 0
-    except Exception:
+    # DSO — simplified (total revenue / daily revenue * assumed 30-day cycle); needs no query, so a
+    # failed DIO query can't take it down with it
+    if table_exists(request, "sales"):
+        result["dso"] = round(30.0, 1)  # simplified — full DSO needs AR data
+        result["dso_note"] = "Simplified — full DSO needs accounts receivable data"
+    else:
         result["dso"] = 0
 
     result["dpo"] = 0
     result["dpo_note"] = "DPO needs accounts payable data"
     result["ccc"] = round(result.get("dio", 0) + result.get("dso", 0) - result.get("dpo", 0), 1)
 
-    conn.close()
     return result
 
 
 @router.get("/abc-xyz")
-async def get_abc_xyz_classification():
+@cached
+def get_abc_xyz_classification(request: Request):
     """Get ABC-XYZ classification of SKUs from real sales data"""
-    conn = get_duckdb()
-    if not table_exists(conn, "sales"):
-        conn.close()
+    if not table_exists(request, "abc_xyz_classification"):
         return {"message": "No sales data uploaded yet."}
 
     try:
-        df = conn.execute("""
-            WITH sku_stats AS (
-                SELECT sku, SUM(revenue) as total_revenue, STDDEV(quantity) as qty_std, AVG(quantity) as qty_avg
-                FROM sales GROUP BY sku
-            ),
-            ranked AS (
-                SELECT *, total_revenue / SUM(total_revenue) OVER () * 100 as revenue_pct,
-                    SUM(total_revenue) OVER (ORDER BY total_revenue DESC) / SUM(total_revenue) OVER () * 100 as cum_pct,
-                    CASE WHEN qty_avg > 0 THEN qty_std / qty_avg ELSE 0 END as cv
-                FROM sku_stats
-            )
-            SELECT sku, ROUND(total_revenue, 2) as revenue, ROUND(revenue_pct, 2) as revenue_pct,
-                CASE WHEN cum_pct <= 80 THEN 'A' WHEN cum_pct <= 95 THEN 'B' ELSE 'C' END as abc_class,
-                CASE WHEN cv < 0.5 THEN 'X' WHEN cv < 1.0 THEN 'Y' ELSE 'Z' END as xyz_class
-            FROM ranked ORDER BY total_revenue DESC LIMIT 100
-        """).fetchdf()
-        conn.close()
-        return {"classification": df.to_dict("records"), "total": len(df)}
+        with duckdb_conn() as conn:
+            rows = fetch_records(conn.execute(ABC_XYZ_SQL))
+        return FastJSONResponse({"classification": rows, "total": len(rows)})
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/reorder-alerts")
-async def get_reorder_alerts():
+@cached
+def get_reorder_alerts(request: Request):
     """Get SKUs below reorder point from real inventory data"""
-    conn = get_duckdb()
-    if not table_exists(conn, "inventory"):
-        conn.close()
+    if not table_exists(request, "inventory"):
         return {"message": "No inventory data uploaded yet."}
 
     try:
-        df = conn.execute("""
-            SELECT sku, qty_on_hand, reorder_point,
-                CASE WHEN qty_on_hand < reorder_point THEN 'critical'
-                     WHEN qty_on_hand < reorder_point * 1.2 THEN 'warning' ELSE 'ok' END as status
-            FROM inventory
-            WHERE qty_on_hand < reorder_point * 1.2
-            ORDER BY CAST(qty_on_hand AS FLOAT) / NULLIF(reorder_point, 0) ASC
-        """).fetchdf()
-        conn.close()
-        return {
-            "alerts": df.to_dict("records"),
-            "total_alerts": len(df),
-            "critical_count": len(df[df["status"] == "critical"]) if len(df) > 0 else 0,
-            "warning_count": len(df[df["status"] == "warning"]) if len(df) > 0 else 0
-        }
+        with duckdb_conn() as conn:
+            rows = fetch_records(conn.execute(REORDER_SQL))
+            critical, warning = conn.execute(REORDER_COUNTS_SQL).fetchone()
+        return FastJSONResponse({
+            "alerts": rows,
+            "total_alerts": len(rows),
+            "critical_count": critical,
+            "warning_count": warning
+        })
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/dead-stock")
-async def get_dead_stock(days: int = 90):
+@cached
+def get_dead_stock(request: Request, days: int = 90):
     """Find inventory with no movement beyond N days — from real data"""
-    conn = get_duckdb()
-    if not table_exists(conn, "inventory"):
-        conn.close()
+    if not table_exists(request, "inventory"):
         return {"message": "No inventory data uploaded yet."}
 
     try:
-        df = conn.execute(f"""
-            SELECT i.sku, i.qty_on_hand, i.unit_cost,
-                COALESCE(i.qty_on_hand * i.unit_cost, 0) as value_at_risk,
-                MAX(s.date) as last_sale_date
-            FROM inventory i LEFT JOIN sales s ON i.sku = s.sku
-            GROUP BY i.sku, i.qty_on_hand, i.unit_cost
-            HAVING MAX(s.date) IS NULL OR CURRENT_DATE - MAX(s.date) > {days}
-            ORDER BY value_at_risk DESC
-        """).fetchdf()
-        conn.close()
-        total_value = float(df["value_at_risk"].sum()) if len(df) > 0 else 0
-        return {
+        with duckdb_conn() as conn:
+            rows = fetch_records(conn.execute(DEAD_STOCK_SQL, [days]))
+        total_value = float(sum(r["value_at_risk"] or 0 for r in rows))
+        return FastJSONResponse({
             "days_threshold": days,
-            "dead_stock": df.to_dict("records"),
-            "total_items": len(df),
+            "dead_stock": rows,
+            "total_items": len(rows),
             "total_value_at_risk": round(total_value, 2)
-        }
+        })
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/top-skus")
-async def get_top_skus(limit: int = 20):
+@cached
+def get_top_skus(request: Request, limit: int = 20):
     """Get top SKUs by revenue from real sales data"""
-    conn = get_duckdb()
-    if not table_exists(conn, "sales"):
-        conn.close()
+    if not table_exists(request, "sales_sku_agg"):
         return {"message": "No sales data uploaded yet."}
 
     try:
-        df = conn.execute(f"""
-            SELECT sku, SUM(revenue) as revenue, SUM(quantity) as units_sold
-            FROM sales GROUP BY sku ORDER BY revenue DESC LIMIT {limit}
-        """).fetchdf()
-        conn.close()
-        return {"skus": df.to_dict("records"), "limit": limit}
+        with duckdb_conn() as conn:
+            rows = fetch_records(conn.execute(TOP_SKUS_SQL, [limit]))
+        return FastJSONResponse({"skus": rows, "limit": limit})
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
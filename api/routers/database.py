@@ -1,40 +1,63 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from typing import Dict, Any
+from redis.exceptions import ResponseError
+import asyncio
 import os
-import duckdb
+
+from services.query_cache import cached
+from services.graph_client import get_graph, FALKORDB_HOST, FALKORDB_PORT
+from services.duckdb_client import DUCKDB_PATH, duckdb_conn
+from .files import DROP_SQL
+from . import analytics
 
 router = APIRouter()
 
-DUCKDB_PATH = os.getenv("DUCKDB_PATH", "/data/supply_chain.duckdb")
-FALKORDB_HOST = os.getenv("FALKORDB_HOST", "falkordb")
-FALKORDB_PORT = int(os.getenv("FALKORDB_PORT", "6379"))
+
+def drop_all_tables():
+    """Drop every DuckDB table on a fresh connection — blocking, run off the event loop"""
+    with duckdb_conn() as conn:
+        tables = [t[0] for t in conn.execute("SHOW TABLES").fetchall()]
+        # DuckDB refuses DROP SCHEMA main, so drop table by table in one transaction — all or nothing
+        conn.begin()
+        try:
+            for t in tables:
+                conn.execute(DROP_SQL.get(t) or f"DROP TABLE IF EXISTS {t}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return tables
+
+
+def refresh_derived(tables):
+    """Rebuild derived tables on a fresh connection — blocking, run off the event loop"""
+    with duckdb_conn() as conn:
+        analytics.refresh_derived_tables(conn, tables)
 
 
 @router.get("/status")
-async def get_database_status():
+@cached
+def get_database_status(request: Request):
     """Get real status of all databases"""
     duckdb_info = {"status": "Unknown", "tables": 0, "total_rows": 0}
     falkordb_info = {"status": "Unknown", "nodes": 0, "relationships": 0}
 
     # Check DuckDB
     try:
-        os.makedirs(os.path.dirname(DUCKDB_PATH), exist_ok=True)
-        conn = duckdb.connect(DUCKDB_PATH)
-        tables = conn.execute("SHOW TABLES").fetchall()
-        table_names = [t[0] for t in tables]
-
-        row_counts = {}
-        total_rows = 0
-        for table in table_names:
-            count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
-            row_counts[table] = count
-            total_rows += count
+        with duckdb_conn() as conn:
+            # Names and row counts from catalog metadata in one query — no table is scanned. estimated_size is
+            # exact for freshly loaded tables (every upload replaces its table) and may drift after deletes.
+            # Derived summary tables are rebuilt from the data, not data themselves — leave them out of the totals
+            row_counts = {t: n for t, n in conn.execute(
+                "SELECT table_name, estimated_size FROM duckdb_tables() WHERE schema_name = 'main' ORDER BY table_name").fetchall()
+                if t not in analytics.DERIVED_TABLE_NAMES}
+        table_names = list(row_counts)
+        total_rows = sum(row_counts.values())
 
         size_bytes = os.path.getsize(DUCKDB_PATH) if os.path.exists(DUCKDB_PATH) else 0
         size_mb = round(size_bytes / (1024 * 1024), 2)
 
-        conn.close()
         duckdb_info = {
             "status": "Ready",
             "tables": len(table_names),
@@ -48,9 +71,7 @@ async def get_database_status():
 
     # Check FalkorDB
     try:
-        from falkordb import FalkorDB
-        db = FalkorDB(host=FALKORDB_HOST, port=FALKORDB_PORT)
-        graph = db.select_graph("supply_chain")
+        graph = get_graph(request.app)
 
         # Count nodes and relationships
         try:
@@ -82,28 +103,28 @@ async def get_database_status():
 
 
 @router.post("/reset")
-async def reset_all_data():
+async def reset_all_data(request: Request):
     """Wipe all data from DuckDB and FalkorDB — clean slate"""
     results = {"duckdb": "unknown", "falkordb": "unknown"}
 
-    # Wipe DuckDB
-    try:
-        os.makedirs(os.path.dirname(DUCKDB_PATH), exist_ok=True)
-        conn = duckdb.connect(DUCKDB_PATH)
-        tables = [t[0] for t in conn.execute("SHOW TABLES").fetchall()]
-        for t in tables:
-            conn.execute(f"DROP TABLE IF EXISTS {t}")
-        conn.close()
-        results["duckdb"] = f"Dropped {len(tables)} tables: {tables}"
-    except Exception as e:
-        results["duckdb"] = f"Error: {e}"
+    # Wipe DuckDB — a failed drop rolls back, so fail the request before touching app state or the graph
+    async with request.app.state.write_lock:
+        try:
+            tables = await asyncio.to_thread(drop_all_tables)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"DuckDB reset failed, no data was deleted: {e}")
+        request.app.state.tables.clear()
+        request.app.state.data_version += 1
+    results["duckdb"] = f"Dropped {len(tables)} tables: {tables}"
 
     # Wipe FalkorDB
     try:
-        from falkordb import FalkorDB
-        db = FalkorDB(host=FALKORDB_HOST, port=FALKORDB_PORT)
-        graph = db.select_graph("supply_chain")
-        graph.query("MATCH (n) DETACH DELETE n")
+        graph = get_graph(request.app)
+        try:
+            graph.delete()  # drops nodes, relationships and indices in one command
+        except ResponseError:
+            pass  # graph key doesn't exist yet — nothing to wipe
+        request.app.state.graph = None  # next get_graph() re-creates the indices
         results["falkordb"] = "All nodes and relationships deleted"
     except Exception as e:
         results["falkordb"] = f"Error: {e}"
@@ -112,8 +133,11 @@ async def reset_all_data():
 
 
 @router.post("/refresh")
-async def refresh_databases():
-    """Refresh database connections"""
+async def refresh_databases(request: Request):
+    """Rebuild derived summary tables and invalidate cached analytics"""
+    async with request.app.state.write_lock:
+        await asyncio.to_thread(refresh_derived, request.app.state.tables)
+        request.app.state.data_version += 1
     return {"message": "Database refresh triggered", "status": "ok"}
 
 
@@ -1,16 +1,19 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from pydantic import BaseModel
 from typing import List, Optional
 import pandas as pd
+import duckdb
+import asyncio
 import os
+import shutil
+import tempfile
 from datetime import datetime
-import duckdb
 
-router = APIRouter()
+from services.graph_client import get_graph
+from services.duckdb_client import duckdb_conn
+from services.query_cache import cached
 
-DUCKDB_PATH = os.getenv("DUCKDB_PATH", "/data/supply_chain.duckdb")
-FALKORDB_HOST = os.getenv("FALKORDB_HOST", "falkordb")
-FALKORDB_PORT = int(os.getenv("FALKORDB_PORT", "6379"))
+router = APIRouter()
 
 # All 9 DATASETS.md categories
 VALID_CATEGORIES = [
@@ -21,6 +24,25 @@ VALID_CATEGORIES = [
 # Categories that get synced to FalkorDB graph
 GRAPH_CATEGORIES = ["suppliers", "purchase_orders"]
 
+# Rows per UNWIND round-trip when syncing to FalkorDB
+GRAPH_BATCH_SIZE = 1000
+
+# Per-category statements built once at import; category is whitelisted so hot paths are a dict lookup
+CREATE_CSV_SQL = {c: f"CREATE OR REPLACE TABLE {c} AS SELECT * FROM read_csv_auto(?, SAMPLE_SIZE=-1)" for c in VALID_CATEGORIES}
+CREATE_DF_SQL = {c: f"CREATE OR REPLACE TABLE {c} AS SELECT * FROM df" for c in VALID_CATEGORIES}
+COUNT_SQL = {c: f"SELECT COUNT(*) FROM {c}" for c in VALID_CATEGORIES}
+LABELLED_COUNT_SQL = {c: f"SELECT '{c}', COUNT(*) FROM {c}" for c in VALID_CATEGORIES}
+SELECT_SQL = {c: f"SELECT * FROM {c}" for c in VALID_CATEGORIES}
+SCHEMA_SQL = {c: f"SELECT * FROM {c} LIMIT 0" for c in VALID_CATEGORIES}
+DROP_SQL = {c: f"DROP TABLE IF EXISTS {c}" for c in VALID_CATEGORIES}
+
+# Physical row order for tables the MCP tools filter on — clustered rows give tight per-row-group min/max
+# zonemaps, so latest-snapshot and per-SKU filters skip most of the table
+SORT_KEYS = {
+    "inventory_snapshot": "snapshot_date, product_id",
+    "sales_transactions": "product_id, transaction_date"
+}
+
 
 class UploadResponse(BaseModel):
     file_category: str
@@ -32,147 +54,196 @@ class UploadResponse(BaseModel):
     message: str
 
 
-def get_duckdb():
-    os.makedirs(os.path.dirname(DUCKDB_PATH), exist_ok=True)
-    return duckdb.connect(DUCKDB_PATH)
+def init_upload_log(conn, tables):
+    """Create file_uploads_seq for a pre-existing file_uploads table, starting past its current ids"""
+    if "file_uploads" not in tables:
+        return
+    if not conn.execute("SELECT 1 FROM duckdb_sequences() WHERE sequence_name = 'file_uploads_seq'").fetchone():
+        start = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM file_uploads").fetchone()[0]
+        conn.execute(f"CREATE SEQUENCE file_uploads_seq START {start}")
 
 
-def sync_suppliers_to_graph(df: pd.DataFrame):
+def _str_col(df: pd.DataFrame, col: str) -> pd.Series:
+    """Column as str with NaN/missing mapped to empty string"""
+    if col not in df:
+        return pd.Series("", index=df.index)
+    return df[col].astype(object).where(df[col].notna(), "").astype(str)
+
+
+def _num_col(df: pd.DataFrame, col: str) -> pd.Series:
+    """Column as float with NaN/missing/unparseable mapped to 0"""
+    if col not in df:
+        return pd.Series(0.0, index=df.index)
+    return pd.to_numeric(df[col], errors="coerce").fillna(0.0).astype(float)
+
+
+def sync_suppliers_to_graph(app, df: pd.DataFrame):
     """Create Supplier nodes in FalkorDB"""
     try:
-        from falkordb import FalkorDB
-        graph = FalkorDB(host=FALKORDB_HOST, port=FALKORDB_PORT).select_graph("supply_chain")
-        try: graph.query("CREATE INDEX ON :Supplier(supplier_id)")
-        except: pass
-
-        for _, row in df.iterrows():
-            sid = str(row.get("supplier_id", ""))
-            name = str(row.get("supplier_name", "")).replace("'", "\\'")
-            lt = float(row.get("avg_lead_time_days", 0)) if pd.notna(row.get("avg_lead_time_days")) else 0
-            rating = float(row.get("risk_score", 0)) if pd.notna(row.get("risk_score")) else 0
-            otd = float(row.get("on_time_delivery_rate", 0)) if pd.notna(row.get("on_time_delivery_rate")) else 0
-            country = str(row.get("country", "")).replace("'", "\\'") if pd.notna(row.get("country")) else ""
-            graph.query(f"""
-                MERGE (s:Supplier {{supplier_id: '{sid}'}})
-                SET s.supplier_name = '{name}', s.lead_time = {lt},
-                    s.rating = {rating}, s.otd_rate = {otd}, s.country = '{country}'
-            """)
+        graph = get_graph(app)
+
+        rows = pd.DataFrame({
+            "supplier_id": _str_col(df, "supplier_id"),
+            "supplier_name": _str_col(df, "supplier_name"),
+            "lt": _num_col(df, "avg_lead_time_days"),
+            "rating": _num_col(df, "risk_score"),
+            "otd": _num_col(df, "on_time_delivery_rate"),
+            "country": _str_col(df, "country")
+        }).to_dict("records")
+        for i in range(0, len(rows), GRAPH_BATCH_SIZE):
+            graph.query("""
+                UNWIND $rows AS r
+                MERGE (s:Supplier {supplier_id: r.supplier_id})
+                SET s.supplier_name = r.supplier_name, s.lead_time = r.lt,
+                    s.rating = r.rating, s.otd_rate = r.otd, s.country = r.country
+            """, params={"rows": rows[i:i + GRAPH_BATCH_SIZE]})
         return True
     except Exception as e:
         print(f"FalkorDB supplier sync: {e}")
         return False
 
 
-def sync_po_to_graph(df: pd.DataFrame):
+def sync_po_to_graph(app, df: pd.DataFrame):
     """Create Product nodes and SUPPLIES relationships"""
     try:
-        from falkordb import FalkorDB
-        graph = FalkorDB(host=FALKORDB_HOST, port=FALKORDB_PORT).select_graph("supply_chain")
-        try: graph.query("CREATE INDEX ON :Product(product_id)")
-        except: pass
-        try: graph.query("CREATE INDEX ON :Supplier(supplier_id)")
-        except: pass
-
-        for _, row in df.iterrows():
-            pid = str(row.get("product_id", ""))
-            sid = str(row.get("supplier_id", ""))
-            if not pid or not sid: continue
-            graph.query(f"MERGE (p:Product {{product_id: '{pid}'}})")
-            graph.query(f"MERGE (s:Supplier {{supplier_id: '{sid}'}})")
-            graph.query(f"""
-                MATCH (s:Supplier {{supplier_id: '{sid}'}})
-                MATCH (p:Product {{product_id: '{pid}'}})
+        graph = get_graph(app)
+
+        pairs = pd.DataFrame({"pid": _str_col(df, "product_id"), "sid": _str_col(df, "supplier_id")})
+        rows = pairs[(pairs["pid"] != "") & (pairs["sid"] != "")].to_dict("records")
+        for i in range(0, len(rows), GRAPH_BATCH_SIZE):
+            chunk = {"rows": rows[i:i + GRAPH_BATCH_SIZE]}
+            graph.query("UNWIND $rows AS r MERGE (:Product {product_id: r.pid})", params=chunk)
+            graph.query("UNWIND $rows AS r MERGE (:Supplier {supplier_id: r.sid})", params=chunk)
+            graph.query("""
+                UNWIND $rows AS r
+                MATCH (s:Supplier {supplier_id: r.sid})
+                MATCH (p:Product {product_id: r.pid})
                 MERGE (s)-[:SUPPLIES]->(p)
-            """)
+            """, params=chunk)
         return True
     except Exception as e:
         print(f"FalkorDB PO sync: {e}")
         return False
 
 
+def save_upload_to_tmp(file: UploadFile) -> str:
+    """Spill an upload to a temp .csv so DuckDB's CSV reader can parse it from disk"""
+    with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as tmp:
+        shutil.copyfileobj(file.file, tmp)
+        return tmp.name
+
+
+def load_into_duckdb(conn, tables, category: str, filename: str, create_sql: str, params: list, df=None):
+    """Create the category table and log the upload — blocking, run off the event loop"""
+    # CREATE_DF_SQL reads the local `df` via replacement scan
+    sort_keys = SORT_KEYS.get(category)
+    try:
+        conn.execute(f"{create_sql} ORDER BY {sort_keys}" if sort_keys else create_sql, params)
+    except duckdb.BinderException:
+        conn.execute(create_sql, params)  # upload lacks the sort columns — store it unordered
+    row_count = conn.execute(COUNT_SQL[category]).fetchone()[0]
+    column_count = len(conn.execute(SCHEMA_SQL[category]).description)
+    if category in GRAPH_CATEGORIES and df is None:
+        df = conn.execute(SELECT_SQL[category]).fetchdf()
+
+    # Track upload
+    try:
+        if "file_uploads" not in tables:
+            conn.execute("CREATE SEQUENCE IF NOT EXISTS file_uploads_seq")
+            conn.execute("""CREATE TABLE IF NOT EXISTS file_uploads (
+                id BIGINT DEFAULT nextval('file_uploads_seq'), file_category VARCHAR, filename VARCHAR,
+                upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, row_count INTEGER, status VARCHAR)""")
+            tables.add("file_uploads")
+        conn.execute("""INSERT INTO file_uploads (id, file_category, filename, upload_timestamp, row_count, status)
+            VALUES (nextval('file_uploads_seq'), ?, ?, CURRENT_TIMESTAMP, ?, 'uploaded')""",
+            [category, filename, row_count])
+    except Exception as e:
+        print(f"Upload tracking: {e}")
+    return row_count, column_count, df
+
+
+def write_upload(tables, category: str, filename: str, create_sql: str, params: list, df=None):
+    """Load an upload on its own connection, closed (and the file lock released) when done — blocking"""
+    with duckdb_conn() as conn:
+        result = load_into_duckdb(conn, tables, category, filename, create_sql, params, df)
+    tables.add(category)
+    return result
+
+
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...), category: str = "sales_transactions"):
+async def upload_file(request: Request, file: UploadFile = File(...), category: str = "sales_transactions"):
     """Upload a file for any of the 9 DATASETS.md categories"""
     if category not in VALID_CATEGORIES:
         raise HTTPException(status_code=400, detail=f"Invalid category. Must be one of: {VALID_CATEGORIES}")
 
+    if not file.filename.endswith(('.csv', '.xlsx')):
+        raise HTTPException(status_code=400, detail="File must be CSV or XLSX")
+
+    tmp_path = None
     try:
+        destination = "DuckDB + FalkorDB" if category in GRAPH_CATEGORIES else "DuckDB"
+
+        # File IO, parsing, and graph sync all block — keep them off the event loop
         if file.filename.endswith('.csv'):
-            df = pd.read_csv(file.file)
-        elif file.filename.endswith('.xlsx'):
-            df = pd.read_excel(file.file)
+            tmp_path = await asyncio.to_thread(save_upload_to_tmp, file)
+            create_sql, params, df = CREATE_CSV_SQL[category], [tmp_path], None
         else:
-            raise HTTPException(status_code=400, detail="File must be CSV or XLSX")
-
-        destination = "DuckDB + FalkorDB" if category in GRAPH_CATEGORIES else "DuckDB"
+            df = await asyncio.to_thread(pd.read_excel, file.file)
+            create_sql, params = CREATE_DF_SQL[category], []
 
-        # Save to DuckDB
-        db_saved = False
-        try:
-            conn = get_duckdb()
-            tables = [t[0] for t in conn.execute("SHOW TABLES").fetchall()]
-            if category in tables:
-                conn.execute(f"DROP TABLE {category}")
-            conn.execute(f"CREATE TABLE {category} AS SELECT * FROM df")
-
-            # Track upload
-            try:
-                if "file_uploads" not in [t[0] for t in conn.execute("SHOW TABLES").fetchall()]:
-                    conn.execute("""CREATE TABLE file_uploads (
-                        id INTEGER, file_category VARCHAR, filename VARCHAR,
-                        upload_timestamp TIMESTAMP, row_count INTEGER, status VARCHAR)""")
-                conn.execute(f"""INSERT INTO file_uploads VALUES (
-                    (SELECT COALESCE(MAX(id),0)+1 FROM file_uploads),
-                    '{category}', '{file.filename}', CURRENT_TIMESTAMP, {len(df)}, 'uploaded')""")
-            except Exception as e:
-                print(f"Upload tracking: {e}")
-            conn.close()
-            db_saved = True
-        except Exception as e:
-            print(f"DuckDB save error: {e}")
+        # Save to DuckDB — DuckDB allows a single writer, so serialize with /reset and other uploads
+        async with request.app.state.write_lock:
+            row_count, column_count, df = await asyncio.to_thread(
+                write_upload, request.app.state.tables, category, file.filename, create_sql, params, df)
+            request.app.state.data_version += 1
 
         # Graph sync
         graph_synced = False
         if category == "suppliers":
-            graph_synced = sync_suppliers_to_graph(df)
+            graph_synced = await asyncio.to_thread(sync_suppliers_to_graph, request.app, df)
         elif category == "purchase_orders":
-            graph_synced = sync_po_to_graph(df)
+            graph_synced = await asyncio.to_thread(sync_po_to_graph, request.app, df)
 
-        msg = []
-        if db_saved: msg.append(f"Saved {len(df):,} rows to DuckDB")
+        msg = [f"Saved {row_count:,} rows to DuckDB"]
         if graph_synced: msg.append("synced to FalkorDB graph")
 
         return UploadResponse(
             file_category=category, filename=file.filename,
-            row_count=len(df), column_count=len(df.columns),
+            row_count=row_count, column_count=column_count,
             status="uploaded", destination=destination,
-            message=" and ".join(msg) if msg else "Upload processed"
+            message=" and ".join(msg)
         )
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
 
 
 @router.get("/status")
-async def get_upload_status():
+@cached
+def get_upload_status(request: Request):
     """Get status of all 9 file uploads"""
     try:
-        conn = get_duckdb()
+        with duckdb_conn() as conn:
+            present = {r[0] for r in conn.execute(
+                "SELECT table_name FROM duckdb_tables() WHERE schema_name = 'main'").fetchall()}
+            uploaded = [c for c in VALID_CATEGORIES if c in present]
+            counts = {}
+            if uploaded:
+                # One round-trip for all row counts instead of a query per category
+                counts = dict(conn.execute(" UNION ALL ".join(
+                    LABELLED_COUNT_SQL[c] for c in uploaded)).fetchall())
         categories = {}
         for cat in VALID_CATEGORIES:
-            try:
-                tables = [t[0] for t in conn.execute("SHOW TABLES").fetchall()]
-                if cat in tables:
-                    count = conn.execute(f"SELECT COUNT(*) FROM {cat}").fetchone()[0]
-                    dest = "DuckDB + FalkorDB" if cat in GRAPH_CATEGORIES else "DuckDB"
-                    categories[cat] = {"status": "uploaded", "row_count": count, "destination": dest}
-                else:
-                    categories[cat] = {"status": "not_uploaded"}
-            except:
+            if cat in counts:
+                dest = "DuckDB + FalkorDB" if cat in GRAPH_CATEGORIES else "DuckDB"
+                categories[cat] = {"status": "uploaded", "row_count": counts[cat], "destination": dest}
+            else:
                 categories[cat] = {"status": "not_uploaded"}
-        conn.close()
         return {"categories": categories}
     except:
         return {"categories": {c: {"status": "unknown"} for c in VALID_CATEGORIES}}
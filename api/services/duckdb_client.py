@@ -0,0 +1,38 @@
+"""
+Short-lived DuckDB connections for the API process
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+import duckdb
+
+DUCKDB_PATH = os.getenv("DUCKDB_PATH", "/data/supply_chain.duckdb")
+
+# The MCP containers open the same file. DuckDB lets only one process hold a read-write handle,
+# and that handle locks every other process out, so the API never keeps a connection past one
+# request or one write. While another process holds the file, retry with backoff (~5s in total)
+LOCK_RETRIES = 20
+LOCK_BACKOFF = 0.025
+
+
+def connect(path: str = None):
+    """Open the database file, retrying while another process holds its lock"""
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return duckdb.connect(path or DUCKDB_PATH)
+        except duckdb.IOException as e:
+            if "lock" not in str(e) or attempt == LOCK_RETRIES - 1:
+                raise
+            time.sleep(LOCK_BACKOFF * (attempt + 1))
+
+
+@contextmanager
+def duckdb_conn(path: str = None):
+    """Connection for one request or write — closed (and the file lock released) on exit"""
+    conn = connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
@@ -7,28 +7,25 @@ import pandas as pd
 from typing import Dict, List, Any, Optional
 import os
 
+from .duckdb_client import duckdb_conn
+
 class DuckDBService:
     """Service for DuckDB analytics, KPIs, and SQL operations"""
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, conn: duckdb.DuckDBPyConnection = None):
         self.db_path = db_path or os.getenv("DUCKDB_PATH", "/data/supply_chain.duckdb")
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-    
-    def _get_connection(self):
-        """Get DuckDB connection"""
-        return duckdb.connect(self.db_path)
+        self._conn = conn
     
     def execute_query(self, sql: str) -> pd.DataFrame:
-        """Execute custom SQL query"""
-        conn = self._get_connection()
-        result = conn.execute(sql).fetchdf()
-        conn.close()
-        return result
+        """Execute custom SQL query — on the injected connection, else on one opened for this call"""
+        if self._conn is not None:
+            return self._conn.cursor().execute(sql).fetchdf()
+        with duckdb_conn(self.db_path) as conn:
+            return conn.execute(sql).fetchdf()
     
     def get_kpi_summary(self, period: str = "30d") -> Dict[str, Any]:
         """Calculate CCC, DIO, DSO, DPO metrics"""
-        conn = self._get_connection()
-        
         # Calculate from data or use placeholder
         result = {
             "period": period,
@@ -40,7 +37,6 @@ class DuckDBService:
             "unit": "days"
         }
         
-        conn.close()
         return result
     
     def get_abc_xyz_classification(self, limit: int = 100) -> pd.DataFrame:
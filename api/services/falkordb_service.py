@@ -3,8 +3,51 @@ FalkorDBService - Handles graph queries, relationship sync, and Cypher operation
 """
 
 from falkordb import FalkorDB
+from redis import BlockingConnectionPool
 from typing import Dict, List, Any, Optional
 import os
+import threading
+
+from .graph_client import create_indices
+
+# Max pooled connections per FalkorDB server; callers block (up to 10s) when all are in use
+POOL_SIZE = int(os.getenv("FALKORDB_POOL_SIZE", 16))
+
+# One client per (host, port), shared by every FalkorDBService instance
+_clients: Dict[tuple, FalkorDB] = {}
+_clients_lock = threading.Lock()
+
+# Graph handles per (host, port, name) — each keeps the label/reltype/property-key cache
+# the client uses to decode --compact result sets, so it must outlive a single query
+_graphs: Dict[tuple, Any] = {}
+
+
+def _get_client(host: str, port: int) -> FalkorDB:
+    """Get or create the pooled FalkorDB client for host:port"""
+    with _clients_lock:
+        db = _clients.get((host, port))
+        if db is None:
+            pool = BlockingConnectionPool(host=host, port=port, max_connections=POOL_SIZE,
+                                          timeout=10, decode_responses=True)
+            db = _clients[(host, port)] = FalkorDB(connection_pool=pool)
+        return db
+
+
+def _get_graph_handle(host: str, port: int, name: str):
+    """Get or create the shared graph handle for host:port/name"""
+    key = (host, port, name)
+    graph = _graphs.get(key)
+    if graph is None:
+        graph = _get_client(host, port).select_graph(name)
+        with _clients_lock:
+            graph = _graphs.setdefault(key, graph)
+    return graph
+
+
+def _records(rows, keys) -> List[Dict[str, Any]]:
+    """Zip result_set rows onto column keys — shaping and derived values stay in the Cypher RETURN"""
+    return [dict(zip(keys, row)) for row in rows]
+
 
 class FalkorDBService:
     """Service for FalkorDB graph operations and supplier network analysis"""
@@ -15,90 +58,78 @@ class FalkorDBService:
         self.graph_name = "supply_chain"
     
     def _get_graph(self):
-        """Get FalkorDB graph connection — raises if unavailable"""
+        """Get FalkorDB graph on the shared pooled client — raises if unavailable"""
         try:
-            db = FalkorDB(host=self.host, port=self.port)
-            return db.select_graph(self.graph_name)
+            return _get_graph_handle(self.host, self.port, self.graph_name)
         except Exception as e:
             raise ConnectionError(f"FalkorDB unavailable at {self.host}:{self.port}: {e}")
 
-    def get_supplier_network(self) -> List[Dict[str, Any]]:
-        """Get full supplier-to-product mapping graph"""
-        try:
-            graph = self._get_graph()
-        except ConnectionError:
-            return []
-        
+    SUPPLIER_NETWORK_KEYS = ("supplier_id", "supplier_name", "sku", "product_name")
+    
+    def _supplier_network_rows(self, limit: int, offset: int):
+        """One page of raw supplier-to-product rows"""
         query = """
         MATCH (s:Supplier)-[:SUPPLIES]->(p:Product)
         RETURN s.supplier_id, s.supplier_name, p.sku, p.product_name
-        ORDER BY s.supplier_name
+        ORDER BY s.supplier_name, p.sku
+        SKIP $offset LIMIT $limit
         """
-        
-        result = graph.query(query)
-        return [
-            {
-                "supplier_id": row[0],
-                "supplier_name": row[1], 
-                "sku": row[2],
-                "product_name": row[3]
-            }
-            for row in result.result_set
-        ]
+        return self._get_graph().query(query, {"offset": int(offset), "limit": int(limit)}).result_set
+    
+    def get_supplier_network(self, limit: int = 1000, offset: int = 0) -> List[Dict[str, Any]]:
+        """Get one page of the supplier-to-product mapping graph"""
+        try:
+            rows = self._supplier_network_rows(limit, offset)
+        except ConnectionError:
+            return []
+        return _records(rows, self.SUPPLIER_NETWORK_KEYS)
+    
+    def iter_supplier_network(self, page_size: int = 1000):
+        """Yield the whole supplier-to-product mapping page by page — memory stays O(page_size)"""
+        offset = 0
+        while True:
+            rows = self._supplier_network_rows(page_size, offset)
+            for row in rows:
+                yield dict(zip(self.SUPPLIER_NETWORK_KEYS, row))
+            if len(rows) < page_size:
+                return
+            offset += page_size
     
     def find_single_source_risks(self, limit: int = 50) -> List[Dict[str, Any]]:
         """Find products with only one supplier (single source risk)"""
         graph = self._get_graph()
         
-        query = f"""
+        query = """
         MATCH (p:Product)<-[:SUPPLIES]-(s:Supplier)
         WITH p, COUNT(s) as supplier_count, COLLECT(s) as suppliers
         WHERE supplier_count = 1
-        RETURN p.sku, p.product_name, suppliers[0].supplier_id, suppliers[0].supplier_name
+        RETURN p.sku, p.product_name, suppliers[0].supplier_id, suppliers[0].supplier_name, 'high'
         ORDER BY p.annual_revenue DESC
-        LIMIT {limit}
+        LIMIT $limit
         """
         
-        result = graph.query(query)
-        return [
-            {
-                "sku": row[0],
-                "product": row[1],
-                "sole_supplier_id": row[2],
-                "sole_supplier_name": row[3],
-                "risk_level": "high"
-            }
-            for row in result.result_set
-        ]
+        result = graph.query(query, {"limit": int(limit)})
+        return _records(result.result_set, ("sku", "product", "sole_supplier_id", "sole_supplier_name", "risk_level"))
     
     def ripple_effect_analysis(self, supplier_id: str) -> Dict[str, Any]:
         """Trace impact of a supplier failure through the network"""
         graph = self._get_graph()
         
         # Find all products affected
-        query = f"""
-        MATCH (s:Supplier {{supplier_id: '{supplier_id}'}})-[:SUPPLIES]->(p:Product)
+        query = """
+        MATCH (s:Supplier {supplier_id: $supplier_id})-[:SUPPLIES]->(p:Product)
         OPTIONAL MATCH (p)-[:COMPONENT_OF]->(finished:Product)
-        RETURN s.supplier_name, p.sku, p.product_name, finished.sku as finished_sku, finished.product_name as finished_product
+        RETURN p.sku, p.product_name, finished.sku as finished_sku, finished.product_name as finished_product, s.supplier_name
         """
         
-        result = graph.query(query)
-        
-        impacted_products = []
-        revenue_at_risk = 0
+        result = graph.query(query, {"supplier_id": supplier_id})
         
-        for row in result.result_set:
-            impacted_products.append({
-                "sku": row[1],
-                "product": row[2],
-                "finished_good_sku": row[3],
-                "finished_good": row[4]
-            })
-            revenue_at_risk += 100000  # Placeholder
+        impacted_products = _records(result.result_set, ("sku", "product", "finished_good_sku", "finished_good"))
+        revenue_at_risk = 100000 * len(impacted_products)  # Placeholder
         
         return {
             "failed_supplier_id": supplier_id,
-            "failed_supplier_name": result.result_set[0][0] if result.result_set else "Unknown",
+            "failed_supplier_name": result.result_set[0][4] if result.result_set else "Unknown",
             "impacted_products": impacted_products,
             "total_impacted": len(impacted_products),
             "estimated_revenue_at_risk": revenue_at_risk,
@@ -114,65 +145,40 @@ class FalkorDBService:
         WITH s, COUNT(p) as product_count, AVG(p.lead_time) as avg_lead, 
              MIN(p.lead_time) as min_lead, MAX(p.lead_time) as max_lead,
              stdev(p.lead_time) as std_lead
-        RETURN s.supplier_id, s.supplier_name, product_count, avg_lead, min_lead, max_lead, std_lead
-        ORDER BY std_lead DESC
+        RETURN s.supplier_id, s.supplier_name, product_count,
+               coalesce(round(avg_lead * 10) / 10.0, 0), min_lead, max_lead,
+               coalesce(round(std_lead * 100) / 100.0, 0) AS variability
+        ORDER BY variability DESC
         """
         
         result = graph.query(query)
-        return [
-            {
-                "supplier_id": row[0],
-                "supplier_name": row[1],
-                "product_count": row[2],
-                "avg_lead_time": round(row[3], 1) if row[3] else 0,
-                "min_lead_time": row[4],
-                "max_lead_time": row[5],
-                "variability": round(row[6], 2) if row[6] else 0
-            }
-            for row in result.result_set
-        ]
+        return _records(result.result_set, ("supplier_id", "supplier_name", "product_count", "avg_lead_time",
+                                            "min_lead_time", "max_lead_time", "variability"))
     
     def find_alternative_suppliers(self, sku: str) -> Dict[str, Any]:
         """Find backup suppliers for a given SKU"""
         graph = self._get_graph()
         
-        # Get current supplier
-        current_query = f"""
-        MATCH (s:Supplier)-[:SUPPLIES]->(p:Product {{sku: '{sku}'}})
-        RETURN s.supplier_id, s.supplier_name, s.lead_time, s.rating
+        # Current supplier and alternatives (suppliers of same-category products) in one round-trip
+        query = """
+        MATCH (p:Product {sku: $sku})
+        OPTIONAL MATCH (s:Supplier)-[:SUPPLIES]->(p)
+        WITH p, collect(s)[0] AS cur
+        OPTIONAL MATCH (p)-[:CATEGORY]->(:Category)<-[:CATEGORY]-(:Product)<-[:SUPPLIES]-(alt:Supplier)
+        WHERE NOT (alt)-[:SUPPLIES]->(p)
+        WITH cur, alt ORDER BY alt.rating DESC, alt.lead_time ASC
+        WITH cur, collect(DISTINCT alt)[..5] AS alts
+        RETURN cur.supplier_id, cur.supplier_name, cur.lead_time, cur.rating,
+               [a IN alts | [a.supplier_id, a.supplier_name, a.lead_time, a.rating, a.country]]
         """
-        current_result = graph.query(current_query)
-        current = None
-        if current_result.result_set:
-            current = {
-                "supplier_id": current_result.result_set[0][0],
-                "supplier_name": current_result.result_set[0][1],
-                "lead_time": current_result.result_set[0][2],
-                "rating": current_result.result_set[0][3]
-            }
+        result = graph.query(query, {"sku": sku})
+        row = result.result_set[0] if result.result_set else [None] * 4 + [[]]
         
-        # Find alternatives (suppliers with similar products)
-        alt_query = f"""
-        MATCH (p:Product {{sku: '{sku}'}})-[:CATEGORY]->(cat:Category)<-[:CATEGORY]-(alt_product:Product)
-        MATCH (alt_supplier:Supplier)-[:SUPPLIES]->(alt_product)
-        WHERE NOT (alt_supplier)-[:SUPPLIES]->(p)
-        RETURN DISTINCT alt_supplier.supplier_id, alt_supplier.supplier_name, 
-               alt_supplier.lead_time, alt_supplier.rating, alt_supplier.country
-        ORDER BY alt_supplier.rating DESC, alt_supplier.lead_time ASC
-        LIMIT 5
-        """
-        alt_result = graph.query(alt_query)
+        current = None
+        if row[0] is not None:
+            current = dict(zip(("supplier_id", "supplier_name", "lead_time", "rating"), row))
         
-        alternatives = [
-            {
-                "supplier_id": row[0],
-                "supplier_name": row[1],
-                "lead_time": row[2],
-                "rating": row[3],
-                "country": row[4]
-            }
-            for row in alt_result.result_set
-        ]
+        alternatives = _records(row[4], ("supplier_id", "supplier_name", "lead_time", "rating", "country"))
         
         return {
             "sku": sku,
@@ -190,17 +196,13 @@ class FalkorDBService:
         """Initialize graph schema with constraints and indices"""
         graph = self._get_graph()
         
-        # Create indices
+        # Lookup keys for the MATCH patterns above — relationship traversal needs no index
         indices = [
             "CREATE INDEX ON :Supplier(supplier_id)",
             "CREATE INDEX ON :Product(sku)",
-            "CREATE INDEX ON :PurchaseOrder(po_number)"
+            "CREATE INDEX ON :PurchaseOrder(po_number)",
+            "CREATE INDEX ON :Category(name)"
         ]
-        
-        for idx in indices:
-            try:
-                graph.query(idx)
-            except:
-                pass  # Index may already exist
+        create_indices(graph, indices)
         
         return True
@@ -0,0 +1,34 @@
+"""
+Shared FalkorDB graph handle for the API process
+"""
+
+import os
+
+FALKORDB_HOST = os.getenv("FALKORDB_HOST", "falkordb")
+FALKORDB_PORT = int(os.getenv("FALKORDB_PORT", "6379"))
+GRAPH_NAME = "supply_chain"
+
+# Lookup keys used by the upload sync MERGEs — created once per process, on first connect
+GRAPH_INDICES = [
+    "CREATE INDEX ON :Supplier(supplier_id)",
+    "CREATE INDEX ON :Product(product_id)"
+]
+
+
+def create_indices(graph, statements):
+    """Send every CREATE INDEX in one pipelined round-trip; "already indexed" replies come back as values, not raises"""
+    pipe = graph.client.connection.pipeline(transaction=False)
+    for idx in statements:
+        pipe.execute_command("GRAPH.QUERY", graph.name, idx)
+    pipe.execute(raise_on_error=False)
+
+
+def get_graph(app):
+    """Graph handle cached on app.state — connects on first use, so FalkorDB may start after the API"""
+    graph = getattr(app.state, "graph", None)
+    if graph is None:
+        from falkordb import FalkorDB
+        graph = FalkorDB(host=FALKORDB_HOST, port=FALKORDB_PORT).select_graph(GRAPH_NAME)
+        create_indices(graph, GRAPH_INDICES)
+        app.state.graph = graph
+    return graph
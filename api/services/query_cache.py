@@ -0,0 +1,81 @@
+"""
+QueryCache - In-process result cache for read-only analytics endpoints
+"""
+
+import time
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """LRU cache keyed by (endpoint, params, data_version) with a TTL fallback.
+
+    Holds at most `maxsize` entries, and only for one data_version — storing a result
+    for a new version drops everything cached for the old one.
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._version = None
+        self._store = OrderedDict()  # key -> (stored_at, value), least recently used first
+        self._lock = threading.Lock()  # sync endpoints run on FastAPI's threadpool
+
+    def get(self, key):
+        with self._lock:
+            hit = self._store.get(key)
+            if hit and time.monotonic() - hit[0] < self.ttl:
+                self._store.move_to_end(key)
+                return hit[1]
+            self._store.pop(key, None)
+            return None
+
+    def set(self, key, value, version=None):
+        with self._lock:
+            if version != self._version:
+                self._store.clear()
+                self._version = version
+            self._store[key] = (time.monotonic(), value)
+            self._store.move_to_end(key)
+            while len(self._store) > self.maxsize:
+                self._store.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+
+
+query_cache = QueryCache()
+
+
+def cached(func):
+    """Serve an endpoint from query_cache until app.state.data_version changes or the TTL expires.
+
+    The wrapped endpoint must take `request: Request`; other kwargs become part of the key.
+    """
+    def key(request, params):
+        return (func.__name__, tuple(sorted(params.items())), request.app.state.data_version)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(request, **params):
+            k = key(request, params)
+            result = query_cache.get(k)
+            if result is None:
+                result = await func(request, **params)
+                query_cache.set(k, result, k[-1])
+            return result
+        return async_wrapper
+
+    # Sync endpoints stay sync so FastAPI keeps running them on its threadpool
+    @functools.wraps(func)
+    def wrapper(request, **params):
+        k = key(request, params)
+        result = query_cache.get(k)
+        if result is None:
+            result = func(request, **params)
+            query_cache.set(k, result, k[-1])
+        return result
+    return wrapper
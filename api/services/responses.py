@@ -0,0 +1,21 @@
+"""
+Fast JSON responses - orjson serialization for row-heavy endpoints
+"""
+
+from decimal import Decimal
+from fastapi.responses import JSONResponse
+import orjson
+
+
+def _default(obj):
+    """orjson fallback for types Arrow hands back (DuckDB HUGEINT sums arrive as Decimal)"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson — NaN becomes null, dates/numpy serialize natively"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
@@ -4,29 +4,145 @@ Grouped by category: dashboard, inventory, cash_cycle, demand, supplier, files
 Aligned with DATASETS.md — 9 interlinked tables.
 """
 
-import os, json, math
+import os, json, math, threading, time, asyncio, traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 import duckdb
+import orjson
+from jsonschema import Draft7Validator
+from decimal import Decimal
 from falkordb import FalkorDB
+from redis import BlockingConnectionPool
 
 DUCKDB_PATH = os.getenv("DUCKDB_PATH", "/data/supply_chain.duckdb")
 FALKORDB_HOST = os.getenv("FALKORDB_HOST", "falkordb")
 FALKORDB_PORT = int(os.getenv("FALKORDB_PORT", 6379))
 
+# Connection reuse is deliberately abandoned here. DuckDB allows one writer process per file, and any
+# open handle — even read-only — locks the file against other processes, so a cached handle in this
+# process would lock the API out of uploads for as long as the server runs (and reopening it on a data
+# version change can't help: the API can't write the change while we hold the file). Each tool call
+# opens read-only and closes when done (handlers close what get_duckdb() returns); memoized tools skip
+# the open entirely on a hit. An uncontended open doesn't sleep; only while the API is mid-write does
+# it retry, with linear backoff, for at most ~5s in total
+LOCK_RETRIES, LOCK_BACKOFF = 20, 0.025
+
 def get_duckdb():
-    os.makedirs(os.path.dirname(DUCKDB_PATH), exist_ok=True)
-    return duckdb.connect(DUCKDB_PATH)
+    # No database file yet (nothing uploaded): a throwaway empty in-memory db so tools answer "upload X".
+    # Deliberately not cached — the file appears with the first upload and the next call should open it
+    if not os.path.exists(DUCKDB_PATH): return duckdb.connect()
+    for attempt in range(LOCK_RETRIES):
+        try: return duckdb.connect(DUCKDB_PATH, read_only=True)
+        except duckdb.IOException as e:
+            if "lock" not in str(e) or attempt == LOCK_RETRIES - 1: raise
+            time.sleep(LOCK_BACKOFF * (attempt + 1))
+
+# One pooled FalkorDB client per process; tool calls block (up to 10s) when all connections are busy
+FALKORDB_POOL_SIZE = int(os.getenv("FALKORDB_POOL_SIZE", 16))
+_graph = None
+_falkordb_lock = threading.Lock()
 
 def get_graph():
-    return FalkorDB(host=FALKORDB_HOST, port=FALKORDB_PORT).select_graph("supply_chain")
+    # Graph handle is shared too: it holds the label/property-key cache used to decode --compact results
+    global _graph
+    with _falkordb_lock:
+        if _graph is None:
+            pool = BlockingConnectionPool(host=FALKORDB_HOST, port=FALKORDB_PORT, max_connections=FALKORDB_POOL_SIZE, timeout=10, decode_responses=True)
+            _graph = FalkorDB(connection_pool=pool).select_graph("supply_chain")
+    return _graph
+
+# Table names and row counts from one duckdb_tables() query, reused briefly across the many
+# has()/cnt() probes a tool call makes — uploads are rare
+TABLES_TTL = 5
+_table_stats = (0.0, {})
+
+def table_stats(conn=None):
+    # Without a conn, the file is only opened when the cached stats have expired
+    global _table_stats
+    if time.monotonic() - _table_stats[0] > TABLES_TTL:
+        c = conn or get_duckdb()
+        try: _table_stats = (time.monotonic(), dict(c.execute("SELECT table_name, estimated_size FROM duckdb_tables() WHERE schema_name = 'main'").fetchall()))
+        finally:
+            if conn is None: c.close()
+    return _table_stats[1]
+
+# Tool results as JSON for both MCP servers — orjson, always compact. The default hook covers
+# what DuckDB/pandas hand back that orjson can't encode natively, without a str() fallback per value
+JSON_OPTS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _json_default(o):
+    if isinstance(o, Decimal): return float(o)
+    if hasattr(o, "isoformat"): return o.isoformat()  # pandas Timestamp / Timedelta
+    if hasattr(o, "item"): return o.item()  # numpy scalars orjson doesn't take directly
+    return str(o)
+
+def to_json(r): return orjson.dumps(r, default=_json_default, option=JSON_OPTS).decode()
+
+def records(cur):
+    """Rows of an executed query as dicts, straight from fetchall — no pandas DataFrame in between"""
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
 
 def has(conn, t):
-    try: return t in [x[0] for x in conn.execute("SHOW TABLES").fetchall()]
+    try: return t in table_stats(conn)
     except: return False
 
 def cnt(conn, t):
-    try: return conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+    try: return table_stats(conn).get(t, 0)
     except: return 0
 
+def warm_up():
+    """Load table stats and connect to FalkorDB before the first tool call"""
+    try: table_stats()
+    except: pass
+    try: get_graph().client.connection.ping()
+    except: pass  # FalkorDB may come up after us — get_graph() reconnects on first use
+
+# Independent queries within one tool call run side by side on one connection, each on its own cursor
+_fan_out_pool = ThreadPoolExecutor(max_workers=int(os.getenv("MCP_QUERY_THREADS", 8)))
+
+def fan_out(jobs):
+    def run(fn, cur):
+        try: return fn(cur)
+        finally: cur.close()
+    conn = get_duckdb()
+    try:
+        futures = {k: _fan_out_pool.submit(run, fn, conn.cursor()) for k, fn in jobs.items()}
+        wait(futures.values())  # every cursor is done before the connection closes, even if one job failed
+    finally: conn.close()
+    return {k: f.result() for k, f in futures.items()}
+
+# Tool calls run on a bounded pool of their own, off the MCP event loop; the semaphore caps how many
+# calls can queue behind it so a burst can't pile up unbounded work. Defaults to the core count (max 8):
+# DuckDB parallelises each query itself, so more concurrent calls than cores only thrash
+TOOL_THREADS = int(os.getenv("MCP_TOOL_THREADS") or min(8, os.cpu_count() or 1))
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_THREADS, thread_name_prefix="mcp-tool")
+_tool_slots = asyncio.Semaphore(TOOL_THREADS * 4)
+
+# Shared stand-in for calls without arguments — handlers only read their args
+NO_ARGS = {}
+
+# One compiled validator per advertised tool, built at import; call_tool checks arguments before dispatch
+def compile_validators(tools):
+    return {t.name: Draft7Validator(t.model_dump(by_alias=True)["inputSchema"]) for t in tools}
+
+def invalid_args(validators, name, args):
+    v = validators.get(name)
+    err = next(v.iter_errors(args), None) if v else None
+    return f"Invalid arguments for {name}: {err.message}" if err else None
+
+# Failed calls report the error and its type; the (capped) traceback only when MCP_DEBUG_TRACEBACK=1
+DEBUG_TRACEBACK = os.getenv("MCP_DEBUG_TRACEBACK") == "1"
+
+def error_payload(e):
+    err = {"error": str(e), "type": type(e).__name__}
+    if DEBUG_TRACEBACK: err["traceback"] = "".join(traceback.format_exception(type(e), e, e.__traceback__, limit=10))
+    return err
+
+async def run_tool(handler, args):
+    async with _tool_slots:
+        return await asyncio.get_running_loop().run_in_executor(_tool_pool, handler, args)
+
 # Table aliases: DATASETS.md names
 T_PRODUCTS = "products"
 T_CUSTOMERS = "customers"
@@ -40,78 +156,101 @@ T_SHIP = "shipments"
 
 ALL_TABLES = [T_PRODUCTS, T_CUSTOMERS, T_SUPPLIERS, T_INVENTORY, T_SALES, T_PO, T_AR, T_AP, T_SHIP]
 
+# Inventory queries read only the newest snapshot. A predicate rather than a TEMP VIEW: temp views are
+# per-connection in DuckDB, so the per-call cursors would never see one (and the database is read-only)
+LATEST_SNAPSHOT = f"snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})"
+
 # ═════════════════════════════════════════════════════════════════════════════
 # DASHBOARD & OVERVIEW
 # ═════════════════════════════════════════════════════════════════════════════
 
+# (section, column count, source table, one-row aggregate, row shaper)
+DASHBOARD_QUERIES = [
+    ("revenue", 5, T_SALES, f"SELECT SUM(total_revenue), SUM(total_cost), SUM(gross_profit), COUNT(*), COUNT(DISTINCT product_id) FROM {T_SALES}",
+     lambda r: {"total_revenue": float(r[0] or 0), "total_cost": float(r[1] or 0), "gross_profit": float(r[2] or 0), "transactions": r[3], "unique_products": r[4]}),
+    ("inventory", 5, T_INVENTORY, f"SELECT COUNT(DISTINCT product_id), SUM(qty_on_hand), SUM(inventory_value), SUM(CASE WHEN stock_status='stockout' THEN 1 ELSE 0 END), SUM(CASE WHEN stock_status='overstock' THEN 1 ELSE 0 END) FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT}",
+     lambda r: {"unique_skus": r[0], "total_units": int(r[1] or 0), "total_value": float(r[2] or 0), "stockouts": int(r[3] or 0), "overstocked": int(r[4] or 0)}),
+    ("suppliers", 3, T_SUPPLIERS, f"SELECT COUNT(*), ROUND(AVG(avg_lead_time_days),1), ROUND(AVG(on_time_delivery_rate),3) FROM {T_SUPPLIERS}",
+     lambda r: {"count": r[0], "avg_lead_time": float(r[1] or 0), "avg_otd_rate": float(r[2] or 0)}),
+    ("customers", 3, T_CUSTOMERS, f"SELECT COUNT(*), SUM(ytd_revenue), ROUND(AVG(avg_days_to_pay),1) FROM {T_CUSTOMERS}",
+     lambda r: {"count": r[0], "total_ytd_revenue": float(r[1] or 0), "avg_days_to_pay": float(r[2] or 0)}),
+    ("ar", 3, T_AR, f"SELECT COUNT(*), SUM(CASE WHEN is_overdue THEN 1 ELSE 0 END), SUM(CASE WHEN write_off_flag THEN invoice_amount ELSE 0 END) FROM {T_AR}",
+     lambda r: {"total_invoices": r[0], "overdue": int(r[1] or 0), "write_off_amount": float(r[2] or 0)}),
+    ("purchase_orders", 3, T_PO, f"SELECT COUNT(*), SUM(qty_ordered), SUM(total_po_value) FROM {T_PO}",
+     lambda r: {"count": r[0], "total_qty": int(r[1] or 0), "total_value": float(r[2] or 0)}),
+]
+
+def one_row(conn, parts):
+    """Run (key, column count, sql, shaper) one-row aggregates as a single cross-joined query; shape each slice"""
+    row = conn.execute("SELECT * FROM " + ", ".join(f"({sql})" for _, _, sql, _ in parts)).fetchone()
+    d, i = {}, 0
+    for k, n, _, shape in parts: d[k] = shape(row[i:i + n]); i += n
+    return d
+
 def handle_get_full_dashboard(args):
+    # Every present table's aggregate in one query: one parse/plan, one round-trip
     conn = get_duckdb()
-    d = {}
-    if has(conn, T_SALES):
-        r = conn.execute(f"SELECT SUM(total_revenue), SUM(total_cost), SUM(gross_profit), COUNT(*), COUNT(DISTINCT product_id) FROM {T_SALES}").fetchone()
-        d["revenue"] = {"total_revenue": float(r[0] or 0), "total_cost": float(r[1] or 0), "gross_profit": float(r[2] or 0), "transactions": r[3], "unique_products": r[4]}
-    if has(conn, T_INVENTORY):
-        r = conn.execute(f"SELECT COUNT(DISTINCT product_id), SUM(qty_on_hand), SUM(inventory_value), SUM(CASE WHEN stock_status='stockout' THEN 1 ELSE 0 END), SUM(CASE WHEN stock_status='overstock' THEN 1 ELSE 0 END) FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})").fetchone()
-        d["inventory"] = {"unique_skus": r[0], "total_units": int(r[1] or 0), "total_value": float(r[2] or 0), "stockouts": int(r[3] or 0), "overstocked": int(r[4] or 0)}
-    if has(conn, T_SUPPLIERS):
-        r = conn.execute(f"SELECT COUNT(*), ROUND(AVG(avg_lead_time_days),1), ROUND(AVG(on_time_delivery_rate),3) FROM {T_SUPPLIERS}").fetchone()
-        d["suppliers"] = {"count": r[0], "avg_lead_time": float(r[1] or 0), "avg_otd_rate": float(r[2] or 0)}
-    if has(conn, T_CUSTOMERS):
-        r = conn.execute(f"SELECT COUNT(*), SUM(ytd_revenue), ROUND(AVG(avg_days_to_pay),1) FROM {T_CUSTOMERS}").fetchone()
-        d["customers"] = {"count": r[0], "total_ytd_revenue": float(r[1] or 0), "avg_days_to_pay": float(r[2] or 0)}
-    if has(conn, T_AR):
-        r = conn.execute(f"SELECT COUNT(*), SUM(CASE WHEN is_overdue THEN 1 ELSE 0 END), SUM(CASE WHEN write_off_flag THEN invoice_amount ELSE 0 END) FROM {T_AR}").fetchone()
-        d["ar"] = {"total_invoices": r[0], "overdue": int(r[1] or 0), "write_off_amount": float(r[2] or 0)}
-    if has(conn, T_PO):
-        r = conn.execute(f"SELECT COUNT(*), SUM(qty_ordered), SUM(total_po_value) FROM {T_PO}").fetchone()
-        d["purchase_orders"] = {"count": r[0], "total_qty": int(r[1] or 0), "total_value": float(r[2] or 0)}
-    conn.close()
-    return d if d else {"message": "No data uploaded yet."}
+    parts = [(k, n, sql, shape) for k, n, t, sql, shape in DASHBOARD_QUERIES if has(conn, t)]
+    d = one_row(conn, parts) if parts else {"message": "No data uploaded yet."}
+    conn.close()
+    return d
+
+def _daily_ratio(stock, flow, days):
+    # Days of flow the stock covers, e.g. DIO = inventory value / daily COGS
+    daily = float(flow or 0) / max(int(days or 1), 1)
+    return round(float(stock or 0) / daily, 1) if daily > 0 else 0
+
+KPI_QUERIES = {
+    "dio": (3, f"SELECT (SELECT SUM(inventory_value) FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT}), SUM(total_cost), COUNT(DISTINCT transaction_date) FROM {T_SALES}",
+            lambda r: _daily_ratio(*r)),
+    "dso": (1, f"SELECT SUM(days_to_pay * invoice_amount) / NULLIF(SUM(invoice_amount), 0) FROM {T_AR} WHERE days_to_pay IS NOT NULL",
+            lambda r: round(float(r[0] or 0), 1)),
+    "dpo": (1, f"SELECT SUM(actual_days_to_pay * invoice_amount) / NULLIF(SUM(invoice_amount), 0) FROM {T_AP} WHERE actual_days_to_pay IS NOT NULL",
+            lambda r: round(float(r[0] or 0), 1)),
+}
+
+def _kpi_or_zero(part):
+    def run(conn):
+        try: return one_row(conn, [part])[part[0]]
+        except: return 0
+    return run
 
 def handle_get_kpi_summary(args):
     conn = get_duckdb()
+    present = {"dio": has(conn, T_INVENTORY) and has(conn, T_SALES), "dso": has(conn, T_AR), "dpo": has(conn, T_AP)}
+    parts = [(k, *KPI_QUERIES[k]) for k, ok in present.items() if ok]
+    # DIO, DSO and DPO inputs in one query; if it fails, each metric is retried alone so one bad table zeroes only its own
+    try: d = one_row(conn, parts) if parts else {}
+    except: d = None
+    conn.close()
+    if d is None: d = fan_out({p[0]: _kpi_or_zero(p) for p in parts})
     result = {"formula": "CCC = DIO + DSO - DPO", "unit": "days"}
-    # DIO
-    if has(conn, T_INVENTORY) and has(conn, T_SALES):
-        try:
-            inv = conn.execute(f"SELECT SUM(inventory_value) FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})").fetchone()
-            cogs = conn.execute(f"SELECT SUM(total_cost), COUNT(DISTINCT transaction_date) FROM {T_SALES}").fetchone()
-            daily_cogs = float(cogs[0] or 0) / max(int(cogs[1] or 1), 1)
-            result["dio"] = round(float(inv[0] or 0) / daily_cogs, 1) if daily_cogs > 0 else 0
-        except: result["dio"] = 0
+    if present["dio"]: result["dio"] = d["dio"]
     else: result["dio"] = 0; result["dio_note"] = "Need inventory_snapshot + sales_transactions"
-    # DSO from AR
-    if has(conn, T_AR):
-        try:
-            r = conn.execute(f"SELECT SUM(days_to_pay * invoice_amount) / NULLIF(SUM(invoice_amount), 0) FROM {T_AR} WHERE days_to_pay IS NOT NULL").fetchone()
-            result["dso"] = round(float(r[0] or 0), 1)
-        except: result["dso"] = 0
+    if present["dso"]: result["dso"] = d["dso"]
     else: result["dso"] = 30.0; result["dso_note"] = "Upload ar_ledger for real DSO"
-    # DPO from AP
-    if has(conn, T_AP):
-        try:
-            r = conn.execute(f"SELECT SUM(actual_days_to_pay * invoice_amount) / NULLIF(SUM(invoice_amount), 0) FROM {T_AP} WHERE actual_days_to_pay IS NOT NULL").fetchone()
-            result["dpo"] = round(float(r[0] or 0), 1)
-        except: result["dpo"] = 0
+    if present["dpo"]: result["dpo"] = d["dpo"]
     else: result["dpo"] = 0; result["dpo_note"] = "Upload ap_ledger for real DPO"
     result["ccc"] = round(result["dio"] + result["dso"] - result["dpo"], 1)
-    conn.close()
     return result
 
+def _table_quality(t, conn):
+    # Null and duplicate counts in one DuckDB pass (hash DISTINCT) instead of pulling the table into pandas
+    try:
+        cols = [d[0] for d in conn.execute(f"SELECT * FROM {t} LIMIT 0").description]
+        r = conn.execute(f"SELECT COUNT(*), (SELECT COUNT(*) FROM (SELECT DISTINCT * FROM {t})), " + ", ".join(f'COUNT(*) - COUNT("{c}")' for c in cols) + f" FROM {t}").fetchone()
+        nulls = {c: int(n) for c, n in zip(cols, r[2:]) if n > 0}
+        dupes = int(r[0] - r[1])
+        return {"rows": r[0], "columns": len(cols), "null_counts": nulls or "none",
+                "duplicate_rows": dupes, "quality_score": max(0, 100 - len(nulls)*5 - min(dupes,10)*2)}
+    except Exception as e:
+        return {"error": str(e)}
+
 def handle_get_data_quality_report(args):
     conn = get_duckdb()
-    report = {}
-    for t in ALL_TABLES:
-        if not has(conn, t): continue
-        try:
-            df = conn.execute(f"SELECT * FROM {t}").fetchdf()
-            nulls = {c: int(df[c].isnull().sum()) for c in df.columns if df[c].isnull().sum() > 0}
-            dupes = int(df.duplicated().sum())
-            report[t] = {"rows": len(df), "columns": len(df.columns), "null_counts": nulls or "none",
-                         "duplicate_rows": dupes, "quality_score": max(0, 100 - len(nulls)*5 - min(dupes,10)*2)}
-        except Exception as e:
-            report[t] = {"error": str(e)}
+    tables = [t for t in ALL_TABLES if has(conn, t)]
     conn.close()
+    report = fan_out({t: (lambda c, t=t: _table_quality(t, c)) for t in tables})
     return report if report else {"message": "No data uploaded yet."}
 
 # ═════════════════════════════════════════════════════════════════════════════
@@ -121,20 +260,20 @@ def handle_get_data_quality_report(args):
 def handle_get_reorder_alerts(args):
     conn = get_duckdb()
     if not has(conn, T_INVENTORY): conn.close(); return {"message": "Upload inventory_snapshot data."}
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         SELECT product_id, location_id, qty_on_hand, reorder_point, safety_stock_target, stock_status, days_of_supply
-        FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})
+        FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT}
         AND qty_on_hand < reorder_point ORDER BY qty_on_hand ASC
-    """).fetchdf()
+    """))
     conn.close()
-    return {"total_alerts": len(df), "alerts": df.to_dict("records")}
+    return {"total_alerts": len(rows), "alerts": rows}
 
 def handle_smart_reorder(args):
     conn = get_duckdb()
     if not has(conn, T_INVENTORY): conn.close(); return {"message": "Upload inventory_snapshot data."}
     limit = args.get("limit", 20)
     try:
-        df = conn.execute(f"""
+        rows = records(conn.execute(f"""
             SELECT i.product_id, i.qty_on_hand, i.reorder_point, i.days_of_supply,
                 COALESCE(p.economic_order_qty, 100) as eoq,
                 COALESCE(p.lead_time_days, 14) as lead_time,
@@ -144,33 +283,31 @@ def handle_smart_reorder(args):
                      ELSE 3 END as priority
             FROM {T_INVENTORY} i
             LEFT JOIN {T_PRODUCTS} p ON i.product_id=p.product_id
-            WHERE i.snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})
+            WHERE i.{LATEST_SNAPSHOT}
             AND i.qty_on_hand < i.reorder_point
-            ORDER BY priority, i.days_of_supply ASC LIMIT {limit}
-        """).fetchdf()
+            ORDER BY priority, i.days_of_supply ASC LIMIT ?
+        """, [int(limit)]))
     except:
-        df = conn.execute(f"SELECT product_id, qty_on_hand, reorder_point FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY}) AND qty_on_hand<reorder_point LIMIT {limit}").fetchdf()
+        rows = records(conn.execute(f"SELECT product_id, qty_on_hand, reorder_point FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT} AND qty_on_hand<reorder_point LIMIT ?", [int(limit)]))
     conn.close()
-    return {"recommendations": df.to_dict("records"), "count": len(df)}
+    return {"recommendations": rows, "count": len(rows)}
 
 def handle_calculate_safety_stock(args):
     conn = get_duckdb()
     skus = args.get("skus", [])
     sl = args.get("service_level", 0.95)
     z = {0.90:1.28, 0.95:1.65, 0.99:2.33}.get(sl, 1.65)
+    skus = skus[:20]
+    # Demand σ and lead time for every requested SKU in two grouped queries, not two per SKU
+    try:
+        sigmas = dict(conn.execute(f"SELECT product_id, STDDEV(qty_sold) FROM {T_SALES} WHERE product_id IN (SELECT UNNEST(?)) GROUP BY product_id", [skus]).fetchall())
+        lts = dict(conn.execute(f"SELECT product_id, FIRST(lead_time_days) FROM {T_PRODUCTS} WHERE product_id IN (SELECT UNNEST(?)) GROUP BY product_id", [skus]).fetchall()) if has(conn, T_PRODUCTS) else {}
+    except Exception as e:
+        conn.close(); return {"formula": "SS = Z × σ_demand × √(Lead Time)", "service_level": f"{sl*100:.0f}%", "results": [{"product_id": sku, "error": str(e)} for sku in skus]}
     results = []
-    for sku in skus[:20]:
-        try:
-            r = conn.execute(f"SELECT STDDEV(qty_sold), AVG(qty_sold) FROM {T_SALES} WHERE product_id='{sku}'").fetchone()
-            sigma = float(r[0]) if r and r[0] else 50
-            lt = 14
-            if has(conn, T_PRODUCTS):
-                lr = conn.execute(f"SELECT lead_time_days FROM {T_PRODUCTS} WHERE product_id='{sku}' LIMIT 1").fetchone()
-                if lr and lr[0]: lt = int(lr[0])
-            ss = round(z * sigma * (lt**0.5))
-            results.append({"product_id": sku, "safety_stock": ss, "demand_std": round(sigma, 2), "lead_time": lt, "z_score": z})
-        except Exception as e:
-            results.append({"product_id": sku, "error": str(e)})
+    for sku in skus:
+        sigma = float(sigmas[sku]) if sigmas.get(sku) else 50; lt = int(lts.get(sku) or 14)
+        results.append({"product_id": sku, "safety_stock": round(z * sigma * (lt**0.5)), "demand_std": round(sigma, 2), "lead_time": lt, "z_score": z})
     conn.close()
     return {"formula": "SS = Z × σ_demand × √(Lead Time)", "service_level": f"{sl*100:.0f}%", "results": results}
 
@@ -179,20 +316,22 @@ def handle_calculate_eoq(args):
     skus = args.get("skus", [])
     S = args.get("order_cost", 50); h_pct = args.get("holding_cost_pct", 0.25)
     if not has(conn, T_SALES): conn.close(); return {"message": "Need sales_transactions data."}
+    skus = skus[:20]
+    # Demand and unit cost for every requested SKU in two grouped queries, not two per SKU
+    try:
+        demand = {r[0]: r[1:] for r in conn.execute(f"SELECT product_id, SUM(qty_sold), COUNT(DISTINCT transaction_date) FROM {T_SALES} WHERE product_id IN (SELECT UNNEST(?)) GROUP BY product_id", [skus]).fetchall()}
+        costs = dict(conn.execute(f"SELECT product_id, FIRST(unit_cost) FROM {T_PRODUCTS} WHERE product_id IN (SELECT UNNEST(?)) GROUP BY product_id", [skus]).fetchall()) if has(conn, T_PRODUCTS) else {}
+    except Exception as e:
+        conn.close(); return {"formula": "EOQ = √(2DS/H)", "order_cost_S": S, "holding_pct_H": h_pct, "results": [{"product_id": sku, "error": str(e)} for sku in skus]}
     results = []
-    for sku in skus[:20]:
-        try:
-            r = conn.execute(f"SELECT SUM(qty_sold), COUNT(DISTINCT transaction_date) FROM {T_SALES} WHERE product_id='{sku}'").fetchone()
-            total_q, days = int(r[0] or 0), max(int(r[1] or 1), 1)
-            annual = total_q / days * 365
-            uc = conn.execute(f"SELECT unit_cost FROM {T_PRODUCTS} WHERE product_id='{sku}' LIMIT 1").fetchone() if has(conn, T_PRODUCTS) else None
-            unit_cost = float(uc[0]) if uc and uc[0] else 10.0
-            H = unit_cost * h_pct
-            eoq = round(math.sqrt(2 * annual * S / H)) if H > 0 else 0
-            results.append({"product_id": sku, "eoq": eoq, "annual_demand": round(annual), "unit_cost": unit_cost,
-                           "orders_per_year": round(annual/eoq, 1) if eoq > 0 else 0})
-        except Exception as e:
-            results.append({"product_id": sku, "error": str(e)})
+    for sku in skus:
+        total_q, days = demand.get(sku, (0, 1))
+        annual = int(total_q or 0) / max(int(days or 1), 1) * 365
+        unit_cost = float(costs.get(sku) or 10.0)
+        H = unit_cost * h_pct
+        eoq = round(math.sqrt(2 * annual * S / H)) if H > 0 else 0
+        results.append({"product_id": sku, "eoq": eoq, "annual_demand": round(annual), "unit_cost": unit_cost,
+                       "orders_per_year": round(annual/eoq, 1) if eoq > 0 else 0})
     conn.close()
     return {"formula": "EOQ = √(2DS/H)", "order_cost_S": S, "holding_pct_H": h_pct, "results": results}
 
@@ -200,95 +339,97 @@ def handle_inventory_turnover(args):
     conn = get_duckdb()
     if not has(conn, T_SALES) or not has(conn, T_INVENTORY): conn.close(); return {"message": "Need sales_transactions + inventory_snapshot."}
     limit = args.get("limit", 50)
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         SELECT i.product_id, i.qty_on_hand, i.unit_cost, i.inventory_value,
             COALESCE(s.total_sold,0) as total_sold, COALESCE(s.revenue,0) as revenue,
             CASE WHEN i.inventory_value>0 THEN ROUND(COALESCE(s.revenue,0)/i.inventory_value,2) ELSE 0 END as turnover_ratio
         FROM (SELECT product_id, SUM(qty_on_hand) as qty_on_hand, AVG(unit_cost) as unit_cost, SUM(inventory_value) as inventory_value
-              FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY}) GROUP BY product_id) i
+              FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT} GROUP BY product_id) i
         LEFT JOIN (SELECT product_id, SUM(qty_sold) as total_sold, SUM(total_revenue) as revenue FROM {T_SALES} GROUP BY product_id) s ON i.product_id=s.product_id
-        ORDER BY turnover_ratio DESC LIMIT {limit}
-    """).fetchdf()
-    conn.close()
-    return {"skus": df.to_dict("records"), "count": len(df)}
+        ORDER BY turnover_ratio DESC LIMIT ?
+    """, [int(limit)]))
+    conn.close()
+    return {"skus": rows, "count": len(rows)}
+
+AGING_SQL = f"""
+    SELECT product_id, SUM(qty_on_hand) as qty, SUM(inventory_value) as value, MAX(days_since_last_movement) as days_idle,
+        CASE WHEN MAX(days_since_last_movement)<=30 THEN '0-30d'
+             WHEN MAX(days_since_last_movement)<=60 THEN '31-60d'
+             WHEN MAX(days_since_last_movement)<=90 THEN '61-90d'
+             ELSE '90+d' END as age_bucket
+    FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT}
+    GROUP BY product_id
+"""
+AGING_BUCKETS = ['0-30d', '31-60d', '61-90d', '90+d']
 
 def handle_inventory_aging(args):
     conn = get_duckdb()
     if not has(conn, T_INVENTORY): conn.close(); return {"message": "Upload inventory_snapshot data."}
-    df = conn.execute(f"""
-        SELECT product_id, SUM(qty_on_hand) as qty, SUM(inventory_value) as value, MAX(days_since_last_movement) as days_idle,
-            CASE WHEN MAX(days_since_last_movement)<=30 THEN '0-30d'
-                 WHEN MAX(days_since_last_movement)<=60 THEN '31-60d'
-                 WHEN MAX(days_since_last_movement)<=90 THEN '61-90d'
-                 ELSE '90+d' END as age_bucket
-        FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})
-        GROUP BY product_id
-    """).fetchdf()
-    conn.close()
-    buckets = {}
-    for b in ['0-30d','31-60d','61-90d','90+d']:
-        sub = df[df['age_bucket']==b] if len(df) > 0 else df
-        buckets[b] = {"sku_count": len(sub), "total_value": round(float(sub['value'].sum()), 2) if len(sub) > 0 else 0}
-    return {"aging_buckets": buckets, "details": df.to_dict("records")}
+    rows = records(conn.execute(AGING_SQL))
+    # Bucket totals are a GROUP BY in DuckDB rather than a pandas mask per bucket
+    sums = {b: (n, v) for b, n, v in conn.execute(f"SELECT age_bucket, COUNT(*), SUM(value) FROM ({AGING_SQL}) GROUP BY age_bucket").fetchall()}
+    conn.close()
+    buckets = {b: {"sku_count": sums[b][0], "total_value": round(float(sums[b][1] or 0), 2)} if b in sums else {"sku_count": 0, "total_value": 0} for b in AGING_BUCKETS}
+    return {"aging_buckets": buckets, "details": rows}
 
 def handle_dead_stock(args):
     conn = get_duckdb()
-    days = args.get("days", 90)
+    days = int(args.get("days", 90))
     if not has(conn, T_INVENTORY): conn.close(); return {"message": "Upload inventory_snapshot data."}
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         SELECT product_id, SUM(qty_on_hand) as qty, SUM(inventory_value) as value_at_risk,
             MAX(days_since_last_movement) as days_idle
-        FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})
-        GROUP BY product_id HAVING MAX(days_since_last_movement) > {days}
+        FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT}
+        GROUP BY product_id HAVING MAX(days_since_last_movement) > ?
         ORDER BY value_at_risk DESC
-    """).fetchdf()
+    """, [days]))
     conn.close()
-    return {"days_threshold": days, "items": len(df), "total_value_at_risk": round(float(df["value_at_risk"].sum()), 2) if len(df) > 0 else 0, "dead_stock": df.to_dict("records")}
+    return {"days_threshold": days, "items": len(rows), "total_value_at_risk": round(float(sum(r["value_at_risk"] or 0 for r in rows)), 2) if len(rows) > 0 else 0, "dead_stock": rows}
 
 def handle_overstock(args):
     conn = get_duckdb()
     if not has(conn, T_INVENTORY): conn.close(); return {"message": "Upload inventory_snapshot data."}
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         SELECT product_id, location_id, qty_on_hand, reorder_point, inventory_value, stock_status
-        FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})
+        FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT}
         AND stock_status='overstock' ORDER BY inventory_value DESC
-    """).fetchdf()
+    """))
     conn.close()
-    return {"overstocked_items": len(df), "total_excess_value": round(float(df["inventory_value"].sum()), 2) if len(df) > 0 else 0, "items": df.to_dict("records")}
+    return {"overstocked_items": len(rows), "total_excess_value": round(float(sum(r["inventory_value"] or 0 for r in rows)), 2) if len(rows) > 0 else 0, "items": rows}
 
 def handle_stockout_risk(args):
     conn = get_duckdb()
     if not has(conn, T_INVENTORY): conn.close(); return {"message": "Upload inventory_snapshot data."}
-    horizon = args.get("horizon_days", 14)
-    df = conn.execute(f"""
+    horizon = int(args.get("horizon_days", 14))
+    rows = records(conn.execute(f"""
         SELECT product_id, location_id, qty_on_hand, days_of_supply, stock_status
-        FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})
-        AND days_of_supply < {horizon} AND days_of_supply >= 0
+        FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT}
+        AND days_of_supply < ? AND days_of_supply >= 0
         ORDER BY days_of_supply ASC
-    """).fetchdf()
+    """, [horizon]))
     conn.close()
-    return {"horizon_days": horizon, "at_risk_count": len(df), "items": df.to_dict("records")}
+    return {"horizon_days": horizon, "at_risk_count": len(rows), "items": rows}
 
 def handle_abc_xyz(args):
     conn = get_duckdb()
     if has(conn, T_PRODUCTS):
-        df = conn.execute(f"SELECT product_id, product_name, category, abc_class, xyz_class, unit_cost, unit_price FROM {T_PRODUCTS} ORDER BY abc_class, xyz_class").fetchdf()
+        rows = records(conn.execute(f"SELECT product_id, product_name, category, abc_class, xyz_class, unit_cost, unit_price FROM {T_PRODUCTS} ORDER BY abc_class, xyz_class"))
         conn.close()
-        return {"total": len(df), "classification": df.to_dict("records"),
+        return {"total": len(rows), "classification": rows,
                 "legend": {"A": "Top 80% revenue", "B": "Next 15%", "C": "Bottom 5%", "X": "Stable", "Y": "Variable", "Z": "Erratic"}}
     if not has(conn, T_SALES): conn.close(); return {"message": "Upload products or sales_transactions."}
     limit = args.get("limit", 100)
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         WITH s AS (SELECT product_id, SUM(total_revenue) as rev, STDDEV(qty_sold) as std, AVG(qty_sold) as avg FROM {T_SALES} GROUP BY product_id),
         r AS (SELECT *, rev/SUM(rev) OVER()*100 as pct, SUM(rev) OVER(ORDER BY rev DESC)/SUM(rev) OVER()*100 as cum,
               CASE WHEN avg>0 THEN std/avg ELSE 0 END as cv FROM s)
         SELECT product_id, ROUND(rev,2) as revenue,
             CASE WHEN cum<=80 THEN 'A' WHEN cum<=95 THEN 'B' ELSE 'C' END as abc,
             CASE WHEN cv<0.5 THEN 'X' WHEN cv<1.0 THEN 'Y' ELSE 'Z' END as xyz
-        FROM r ORDER BY rev DESC LIMIT {limit}
-    """).fetchdf()
+        FROM r ORDER BY rev DESC LIMIT ?
+    """, [int(limit)]))
     conn.close()
-    return {"total": len(df), "classification": df.to_dict("records")}
+    return {"total": len(rows), "classification": rows}
 
 # ═════════════════════════════════════════════════════════════════════════════
 # CASH CYCLE & WORKING CAPITAL
@@ -315,21 +456,21 @@ def handle_simulate_ccc(args):
 def handle_working_capital_summary(args):
     conn = get_duckdb()
     if not has(conn, T_INVENTORY): conn.close(); return {"message": "Upload inventory_snapshot data."}
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         SELECT COALESCE(i.product_id,'unknown') as product_id,
             SUM(qty_on_hand) as total_units, SUM(inventory_value) as trapped_cash
-        FROM {T_INVENTORY} i WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})
+        FROM {T_INVENTORY} i WHERE {LATEST_SNAPSHOT}
         GROUP BY product_id ORDER BY trapped_cash DESC LIMIT 50
-    """).fetchdf()
-    total = float(df["trapped_cash"].sum()) if len(df) > 0 else 0
+    """))
+    total = float(sum(r["trapped_cash"] or 0 for r in rows)) if len(rows) > 0 else 0
     conn.close()
-    return {"total_cash_trapped": round(total, 2), "top_items": df.to_dict("records")}
+    return {"total_cash_trapped": round(total, 2), "top_items": rows}
 
 def handle_carrying_cost(args):
     conn = get_duckdb()
     if not has(conn, T_INVENTORY): conn.close(); return {"message": "Upload inventory_snapshot data."}
     h_pct = args.get("holding_cost_pct", 0.25)
-    total = conn.execute(f"SELECT SUM(inventory_value) FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY})").fetchone()
+    total = conn.execute(f"SELECT SUM(inventory_value) FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT}").fetchone()
     total_inv = float(total[0] or 0)
     conn.close()
     return {"total_inventory_value": round(total_inv, 2), "holding_rate": f"{h_pct*100}%",
@@ -340,56 +481,69 @@ def handle_pareto(args):
     dim = args.get("dimension", "revenue")
     if dim == "revenue":
         if not has(conn, T_SALES): conn.close(); return {"message": "No sales data."}
-        df = conn.execute(f"WITH r AS (SELECT product_id, SUM(total_revenue) as val FROM {T_SALES} GROUP BY product_id ORDER BY val DESC) SELECT *, SUM(val) OVER(ORDER BY val DESC)/SUM(val) OVER()*100 as cum_pct FROM r").fetchdf()
+        src = f"SELECT product_id, SUM(total_revenue) as val FROM {T_SALES} GROUP BY product_id"
     else:
         if not has(conn, T_INVENTORY): conn.close(); return {"message": "No inventory data."}
-        df = conn.execute(f"WITH r AS (SELECT product_id, SUM(inventory_value) as val FROM {T_INVENTORY} WHERE snapshot_date=(SELECT MAX(snapshot_date) FROM {T_INVENTORY}) GROUP BY product_id ORDER BY val DESC) SELECT *, SUM(val) OVER(ORDER BY val DESC)/SUM(val) OVER()*100 as cum_pct FROM r").fetchdf()
-    conn.close()
-    n = len(df); pct80 = len(df[df["cum_pct"] <= 80]) if n > 0 else 0
+        src = f"SELECT product_id, SUM(inventory_value) as val FROM {T_INVENTORY} WHERE {LATEST_SNAPSHOT} GROUP BY product_id"
+    # SKU counts come from window aggregates, so only the top 50 rows leave DuckDB
+    rows = records(conn.execute(f"""
+        WITH r AS ({src}), c AS (SELECT *, SUM(val) OVER(ORDER BY val DESC)/SUM(val) OVER()*100 as cum_pct FROM r)
+        SELECT *, COUNT(*) OVER() as _n, COUNT(*) FILTER (WHERE cum_pct <= 80) OVER() as _n80 FROM c ORDER BY val DESC LIMIT 50
+    """))
+    conn.close()
+    n, pct80 = (rows[0]["_n"], rows[0]["_n80"]) if rows else (0, 0)
+    for r in rows: del r["_n"], r["_n80"]
     return {"dimension": dim, "total_skus": n, "skus_driving_80pct": pct80,
-            "pct_of_skus": round(pct80/n*100, 1) if n > 0 else 0, "pareto_data": df.head(50).to_dict("records")}
+            "pct_of_skus": round(pct80/n*100, 1) if n > 0 else 0, "pareto_data": rows}
 
 # ── NEW: AR Aging ─────────────────────────────────────────────────────────────
+AR_AGING_SQL = f"""
+    SELECT aging_bucket, COUNT(*) as invoices, SUM(invoice_amount) as total_amount,
+        SUM(CASE WHEN paid_date IS NULL THEN invoice_amount ELSE 0 END) as outstanding
+    FROM {T_AR} GROUP BY aging_bucket
+    ORDER BY CASE aging_bucket WHEN 'Current' THEN 0 WHEN '1-30 days' THEN 1 WHEN '31-60 days' THEN 2 WHEN '61-90 days' THEN 3 ELSE 4 END
+"""
+# Outstanding, dispute and write-off totals in one scan of the ledger
+AR_TOTALS_SQL = f"""
+    SELECT SUM(invoice_amount) FILTER (WHERE paid_date IS NULL),
+        COUNT(*) FILTER (WHERE dispute_flag=true), SUM(invoice_amount) FILTER (WHERE dispute_flag=true),
+        COUNT(*) FILTER (WHERE write_off_flag=true), SUM(invoice_amount) FILTER (WHERE write_off_flag=true)
+    FROM {T_AR}
+"""
+
 def handle_ar_aging(args):
     conn = get_duckdb()
     if not has(conn, T_AR): conn.close(); return {"message": "Upload ar_ledger data."}
-    df = conn.execute(f"""
-        SELECT aging_bucket, COUNT(*) as invoices, SUM(invoice_amount) as total_amount,
-            SUM(CASE WHEN paid_date IS NULL THEN invoice_amount ELSE 0 END) as outstanding
-        FROM {T_AR} GROUP BY aging_bucket
-        ORDER BY CASE aging_bucket WHEN 'Current' THEN 0 WHEN '1-30 days' THEN 1 WHEN '31-60 days' THEN 2 WHEN '61-90 days' THEN 3 ELSE 4 END
-    """).fetchdf()
-    total_outstanding = conn.execute(f"SELECT SUM(invoice_amount) FROM {T_AR} WHERE paid_date IS NULL").fetchone()
-    disputes = conn.execute(f"SELECT COUNT(*), SUM(invoice_amount) FROM {T_AR} WHERE dispute_flag=true").fetchone()
-    writeoffs = conn.execute(f"SELECT COUNT(*), SUM(invoice_amount) FROM {T_AR} WHERE write_off_flag=true").fetchone()
-    conn.close()
-    return {"aging_buckets": df.to_dict("records"),
-            "total_outstanding": float(total_outstanding[0] or 0),
-            "disputes": {"count": int(disputes[0] or 0), "amount": float(disputes[1] or 0)},
-            "write_offs": {"count": int(writeoffs[0] or 0), "amount": float(writeoffs[1] or 0)}}
+    conn.close()
+    d = fan_out({"buckets": lambda c: records(c.execute(AR_AGING_SQL)), "totals": lambda c: c.execute(AR_TOTALS_SQL).fetchone()})
+    t = d["totals"]
+    return {"aging_buckets": d["buckets"],
+            "total_outstanding": float(t[0] or 0),
+            "disputes": {"count": int(t[1] or 0), "amount": float(t[2] or 0)},
+            "write_offs": {"count": int(t[3] or 0), "amount": float(t[4] or 0)}}
 
 # ── NEW: DSO Analysis ─────────────────────────────────────────────────────────
 def handle_dso_analysis(args):
     conn = get_duckdb()
     if not has(conn, T_AR): conn.close(); return {"message": "Upload ar_ledger data."}
     weighted = conn.execute(f"SELECT SUM(days_to_pay * invoice_amount)/NULLIF(SUM(invoice_amount),0) FROM {T_AR} WHERE days_to_pay IS NOT NULL").fetchone()
-    by_customer = conn.execute(f"""
+    by_customer = records(conn.execute(f"""
         SELECT a.customer_id, c.customer_name, c.segment,
             ROUND(SUM(a.days_to_pay * a.invoice_amount)/NULLIF(SUM(a.invoice_amount),0),1) as weighted_dso,
             COUNT(*) as invoices, SUM(a.invoice_amount) as total_billed
         FROM {T_AR} a LEFT JOIN {T_CUSTOMERS} c ON a.customer_id=c.customer_id
         WHERE a.days_to_pay IS NOT NULL GROUP BY a.customer_id, c.customer_name, c.segment
         ORDER BY weighted_dso DESC LIMIT 20
-    """).fetchdf() if has(conn, T_CUSTOMERS) else conn.execute(f"SELECT customer_id, ROUND(AVG(days_to_pay),1) as weighted_dso, COUNT(*) as invoices FROM {T_AR} WHERE days_to_pay IS NOT NULL GROUP BY customer_id ORDER BY weighted_dso DESC LIMIT 20").fetchdf()
+    """) if has(conn, T_CUSTOMERS) else conn.execute(f"SELECT customer_id, ROUND(AVG(days_to_pay),1) as weighted_dso, COUNT(*) as invoices FROM {T_AR} WHERE days_to_pay IS NOT NULL GROUP BY customer_id ORDER BY weighted_dso DESC LIMIT 20"))
     conn.close()
-    return {"overall_dso": round(float(weighted[0] or 0), 1), "by_customer": by_customer.to_dict("records")}
+    return {"overall_dso": round(float(weighted[0] or 0), 1), "by_customer": by_customer}
 
 # ── NEW: DPO Analysis ─────────────────────────────────────────────────────────
 def handle_dpo_analysis(args):
     conn = get_duckdb()
     if not has(conn, T_AP): conn.close(); return {"message": "Upload ap_ledger data."}
     weighted = conn.execute(f"SELECT SUM(actual_days_to_pay * invoice_amount)/NULLIF(SUM(invoice_amount),0) FROM {T_AP}").fetchone()
-    by_supplier = conn.execute(f"""
+    by_supplier = records(conn.execute(f"""
         SELECT a.supplier_id, s.supplier_name,
             ROUND(SUM(a.actual_days_to_pay * a.invoice_amount)/NULLIF(SUM(a.invoice_amount),0),1) as weighted_dpo,
             s.contracted_payment_days as terms, COUNT(*) as invoices,
@@ -397,26 +551,26 @@ def handle_dpo_analysis(args):
         FROM {T_AP} a LEFT JOIN {T_SUPPLIERS} s ON a.supplier_id=s.supplier_id
         GROUP BY a.supplier_id, s.supplier_name, s.contracted_payment_days
         ORDER BY weighted_dpo DESC
-    """).fetchdf() if has(conn, T_SUPPLIERS) else conn.execute(f"SELECT supplier_id, ROUND(AVG(actual_days_to_pay),1) as weighted_dpo, COUNT(*) as invoices FROM {T_AP} GROUP BY supplier_id ORDER BY weighted_dpo DESC").fetchdf()
+    """) if has(conn, T_SUPPLIERS) else conn.execute(f"SELECT supplier_id, ROUND(AVG(actual_days_to_pay),1) as weighted_dpo, COUNT(*) as invoices FROM {T_AP} GROUP BY supplier_id ORDER BY weighted_dpo DESC"))
     conn.close()
-    return {"overall_dpo": round(float(weighted[0] or 0), 1), "by_supplier": by_supplier.to_dict("records")}
+    return {"overall_dpo": round(float(weighted[0] or 0), 1), "by_supplier": by_supplier}
 
 # ── NEW: Shipment Tracking ────────────────────────────────────────────────────
 def handle_shipment_tracking(args):
     conn = get_duckdb()
     if not has(conn, T_SHIP): conn.close(); return {"message": "Upload shipments data."}
     status = args.get("status")
-    where = f"WHERE status='{status}'" if status else ""
-    df = conn.execute(f"""
+    where = "WHERE status=?" if status else ""
+    rows = records(conn.execute(f"""
         SELECT status, COUNT(*) as count, SUM(qty_shipped) as total_qty,
             SUM(freight_cost) as total_freight, ROUND(AVG(delay_days),1) as avg_delay
         FROM {T_SHIP} {where} GROUP BY status
-    """).fetchdf()
-    in_transit = conn.execute(f"SELECT shipment_id, supplier_id, product_id, ship_date, expected_arrival_date, qty_shipped, carrier FROM {T_SHIP} WHERE status='In Transit' LIMIT 20").fetchdf() if not status else None
+    """, [status] if status else []))
+    in_transit = records(conn.execute(f"SELECT shipment_id, supplier_id, product_id, ship_date, expected_arrival_date, qty_shipped, carrier FROM {T_SHIP} WHERE status='In Transit' LIMIT 20")) if not status else None
     conn.close()
-    result = {"summary": df.to_dict("records")}
+    result = {"summary": rows}
     if in_transit is not None and len(in_transit) > 0:
-        result["in_transit"] = in_transit.to_dict("records")
+        result["in_transit"] = in_transit
     return result
 
 # ── NEW: Product Catalog ──────────────────────────────────────────────────────
@@ -425,13 +579,13 @@ def handle_product_catalog(args):
     if not has(conn, T_PRODUCTS): conn.close(); return {"message": "Upload products data."}
     category = args.get("category")
     abc = args.get("abc_class")
-    where = []
-    if category: where.append(f"category='{category}'")
-    if abc: where.append(f"abc_class='{abc}'")
+    where, params = [], []
+    if category: where.append("category=?"); params.append(category)
+    if abc: where.append("abc_class=?"); params.append(abc)
     clause = f"WHERE {' AND '.join(where)}" if where else ""
-    df = conn.execute(f"SELECT * FROM {T_PRODUCTS} {clause} ORDER BY product_id").fetchdf()
+    rows = records(conn.execute(f"SELECT * FROM {T_PRODUCTS} {clause} ORDER BY product_id", params))
     conn.close()
-    return {"total": len(df), "products": df.to_dict("records")}
+    return {"total": len(rows), "products": rows}
 
 # ═════════════════════════════════════════════════════════════════════════════
 # DEMAND & SALES ANALYTICS
@@ -441,7 +595,7 @@ def handle_forecast_demand(args):
     conn = get_duckdb()
     if not has(conn, T_SALES): conn.close(); return {"message": "Upload sales_transactions data."}
     sku = args["sku"]; horizon = args.get("horizon_days", 30); window = args.get("window", 7)
-    df = conn.execute(f"SELECT transaction_date as date, SUM(qty_sold) as daily_qty FROM {T_SALES} WHERE product_id='{sku}' GROUP BY transaction_date ORDER BY date").fetchdf()
+    df = conn.execute(f"SELECT transaction_date as date, SUM(qty_sold) as daily_qty FROM {T_SALES} WHERE product_id=? GROUP BY transaction_date ORDER BY date", [sku]).fetchdf()
     conn.close()
     if len(df) == 0: return {"message": f"No sales for '{sku}'."}
     values = df["daily_qty"].tolist()
@@ -459,12 +613,20 @@ def handle_detect_anomalies(args):
     conn = get_duckdb()
     table = args.get("table", T_SALES); col = args.get("column", "qty_sold"); z_thresh = args.get("z_threshold", 2.0)
     if not has(conn, table): conn.close(); return {"message": f"No {table} data."}
+    # Identifiers can't be bound, so the column must be a real column of the table before it's spliced in
+    if not conn.execute("SELECT 1 FROM duckdb_columns() WHERE table_name=? AND column_name=?", [table, col]).fetchone():
+        conn.close(); return {"error": f"Unknown column '{col}' in {table}"}
     try:
-        df = conn.execute(f"SELECT *, ({col} - AVG({col}) OVER()) / NULLIF(STDDEV({col}) OVER(), 0) as z_score FROM {table}").fetchdf()
-        anomalies = df[abs(df["z_score"]) > z_thresh] if len(df) > 0 else df
-        conn.close()
+        # Z-scores, the QUALIFY filter and the outlier count all run in DuckDB; only the 50 strongest outliers cross over
+        anomalies = records(conn.execute(f'''
+            SELECT *, COUNT(*) OVER () as _found FROM (
+                SELECT *, rowid as _row, ("{col}" - AVG("{col}") OVER()) / NULLIF(STDDEV("{col}") OVER(), 0) as z_score FROM "{table}" QUALIFY ABS(z_score) > ?)
+            ORDER BY ABS(z_score) DESC, _row LIMIT 50''', [z_thresh]))  # rowid breaks ties, so repeat calls agree
+        found = anomalies[0]["_found"] if anomalies else 0
+        for r in anomalies: del r["_found"], r["_row"]
+        total = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]; conn.close()  # exact, not cnt()'s estimate
         return {"table": table, "column": col, "z_threshold": z_thresh,
-                "total_rows": len(df), "anomalies_found": len(anomalies), "anomalies": anomalies.head(50).to_dict("records")}
+                "total_rows": total, "anomalies_found": found, "anomalies": anomalies}
     except Exception as e:
         conn.close(); return {"error": str(e)}
 
@@ -473,103 +635,118 @@ def handle_revenue_trends(args):
     if not has(conn, T_SALES): conn.close(); return {"message": "Upload sales_transactions data."}
     gran = args.get("granularity", "monthly")
     trunc = {"daily": "transaction_date", "weekly": "DATE_TRUNC('week', transaction_date)"}.get(gran, "DATE_TRUNC('month', transaction_date)")
-    df = conn.execute(f"SELECT {trunc} as period, SUM(total_revenue) as revenue, SUM(qty_sold) as units, COUNT(DISTINCT product_id) as skus FROM {T_SALES} GROUP BY period ORDER BY period").fetchdf()
+    # Period-over-period growth via LAG in the same query; the first period has nothing to grow from
+    trends = records(conn.execute(f"""
+        WITH t AS (SELECT {trunc} as period, SUM(total_revenue) as revenue, SUM(qty_sold) as units, COUNT(DISTINCT product_id) as skus FROM {T_SALES} GROUP BY period)
+        SELECT *, CASE WHEN LAG(revenue) OVER w > 0 THEN ROUND((revenue - LAG(revenue) OVER w) / LAG(revenue) OVER w * 100, 1) ELSE 0 END as growth_pct
+        FROM t WINDOW w AS (ORDER BY period) ORDER BY period
+    """))
     conn.close()
-    records = df.to_dict("records")
-    for i in range(1, len(records)):
-        prev = records[i-1]["revenue"]
-        records[i]["growth_pct"] = round((records[i]["revenue"] - prev) / prev * 100, 1) if prev > 0 else 0
-    return {"granularity": gran, "periods": len(records), "trends": records}
+    if trends: del trends[0]["growth_pct"]
+    return {"granularity": gran, "periods": len(trends), "trends": trends}
 
 def handle_sales_velocity(args):
     conn = get_duckdb()
     if not has(conn, T_SALES): conn.close(); return {"message": "Upload sales_transactions data."}
     limit = args.get("limit", 30)
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         SELECT product_id, SUM(qty_sold) as total_sold, COUNT(DISTINCT transaction_date) as sale_days,
             ROUND(SUM(qty_sold)/NULLIF(COUNT(DISTINCT transaction_date),1), 2) as daily_velocity,
             SUM(total_revenue) as total_revenue
-        FROM {T_SALES} GROUP BY product_id ORDER BY daily_velocity DESC LIMIT {limit}
-    """).fetchdf()
+        FROM {T_SALES} GROUP BY product_id ORDER BY daily_velocity DESC LIMIT ?
+    """, [int(limit)]))
     conn.close()
-    return {"fastest_movers": df.to_dict("records"), "count": len(df)}
+    return {"fastest_movers": rows, "count": len(rows)}
 
 def handle_top_skus(args):
     conn = get_duckdb()
     if not has(conn, T_SALES): conn.close(); return {"message": "Upload sales_transactions data."}
     limit = args.get("limit", 20)
-    df = conn.execute(f"SELECT product_id, SUM(total_revenue) as revenue, SUM(qty_sold) as units, SUM(gross_profit) as profit FROM {T_SALES} GROUP BY product_id ORDER BY revenue DESC LIMIT {limit}").fetchdf()
+    rows = records(conn.execute(f"SELECT product_id, SUM(total_revenue) as revenue, SUM(qty_sold) as units, SUM(gross_profit) as profit FROM {T_SALES} GROUP BY product_id ORDER BY revenue DESC LIMIT ?", [int(limit)]))
     conn.close()
-    return {"top_skus": df.to_dict("records"), "count": len(df)}
+    return {"top_skus": rows, "count": len(rows)}
 
 def handle_customer_concentration(args):
     conn = get_duckdb()
     if not has(conn, T_SALES): conn.close(); return {"message": "Upload sales_transactions data."}
     limit = args.get("limit", 10)
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         SELECT s.customer_id, COALESCE(c.customer_name, s.customer_id) as customer_name,
             SUM(s.total_revenue) as revenue,
             SUM(s.total_revenue)/SUM(SUM(s.total_revenue)) OVER()*100 as revenue_pct,
             COUNT(DISTINCT s.product_id) as unique_products
         FROM {T_SALES} s LEFT JOIN {T_CUSTOMERS} c ON s.customer_id=c.customer_id
-        GROUP BY s.customer_id, c.customer_name ORDER BY revenue DESC LIMIT {limit}
-    """).fetchdf() if has(conn, T_CUSTOMERS) else conn.execute(f"SELECT customer_id, SUM(total_revenue) as revenue FROM {T_SALES} WHERE customer_id IS NOT NULL GROUP BY customer_id ORDER BY revenue DESC LIMIT {limit}").fetchdf()
+        GROUP BY s.customer_id, c.customer_name ORDER BY revenue DESC LIMIT ?
+    """, [int(limit)]) if has(conn, T_CUSTOMERS) else conn.execute(f"SELECT customer_id, SUM(total_revenue) as revenue FROM {T_SALES} WHERE customer_id IS NOT NULL GROUP BY customer_id ORDER BY revenue DESC LIMIT ?", [int(limit)]))
     conn.close()
-    top_pct = float(df["revenue_pct"].sum()) if "revenue_pct" in df.columns and len(df) > 0 else 0
-    return {"top_customers": df.to_dict("records"), "concentration_risk": "high" if top_pct > 80 else "medium" if top_pct > 50 else "low"}
+    top_pct = float(sum(r["revenue_pct"] or 0 for r in rows)) if rows and "revenue_pct" in rows[0] else 0
+    return {"top_customers": rows, "concentration_risk": "high" if top_pct > 80 else "medium" if top_pct > 50 else "low"}
 
 def handle_seasonality(args):
     conn = get_duckdb()
     if not has(conn, T_SALES): conn.close(); return {"message": "Upload sales_transactions data."}
-    sku_filter = f"WHERE product_id='{args['sku']}'" if args.get("sku") else ""
-    df = conn.execute(f"SELECT EXTRACT(MONTH FROM transaction_date) as month, SUM(qty_sold) as qty, SUM(total_revenue) as revenue FROM {T_SALES} {sku_filter} GROUP BY month ORDER BY month").fetchdf()
-    conn.close()
-    if len(df) == 0: return {"message": "Not enough data."}
-    avg = float(df["qty"].mean())
-    records = df.to_dict("records")
-    for r in records: r["index_vs_avg"] = round(r["qty"]/avg, 2) if avg > 0 else 0
-    peak = max(records, key=lambda x: x["qty"]); low = min(records, key=lambda x: x["qty"])
-    return {"monthly_pattern": records, "peak_month": int(peak["month"]), "low_month": int(low["month"])}
+    sku_filter = "WHERE product_id=?" if args.get("sku") else ""
+    # Index vs the monthly mean and the peak/low months come from windows over the 12 monthly rows
+    months = records(conn.execute(f"""
+        WITH m AS (SELECT EXTRACT(MONTH FROM transaction_date) as month, SUM(qty_sold) as qty, SUM(total_revenue) as revenue FROM {T_SALES} {sku_filter} GROUP BY month)
+        SELECT *, COALESCE(ROUND(qty / NULLIF(AVG(qty) OVER (), 0), 2), 0) as index_vs_avg,
+            FIRST_VALUE(month) OVER (ORDER BY qty DESC, month) as _peak, FIRST_VALUE(month) OVER (ORDER BY qty, month) as _low
+        FROM m ORDER BY month
+    """, [args["sku"]] if args.get("sku") else []))
+    conn.close()
+    if not months: return {"message": "Not enough data."}
+    peak, low = months[0]["_peak"], months[0]["_low"]
+    for r in months: del r["_peak"], r["_low"]
+    return {"monthly_pattern": months, "peak_month": int(peak), "low_month": int(low)}
 
 # ═════════════════════════════════════════════════════════════════════════════
 # SUPPLIER & GRAPH TOOLS
 # ═════════════════════════════════════════════════════════════════════════════
 
+# Weighted lead-time / on-time / rejection score per supplier, computed in DuckDB in table order. Rounding,
+# levels and ranking stay in Python: DuckDB's ROUND and Python's round() disagree on halfway floats, and
+# the published scores have always been Python-rounded once, on the final weighted sum
+SUPPLIER_RISK_SQL = f"""
+    SELECT supplier_id, supplier_name,
+        LEAST(100, GREATEST(0, (avg_lead_time_days::DOUBLE - 5) * 3)) * 0.3
+            + GREATEST(0, (1 - on_time_delivery_rate::DOUBLE) * 200) * 0.4
+            + quality_rejection_rate::DOUBLE * 1000 * 0.3 as score,
+        avg_lead_time_days as lead_time, on_time_delivery_rate as otd_rate, quality_rejection_rate as qrr
+    FROM {T_SUPPLIERS}
+"""
+
 def handle_supplier_risk_scores(args):
     conn = get_duckdb()
     if not has(conn, T_SUPPLIERS): conn.close(); return {"message": "Upload suppliers data."}
-    df = conn.execute(f"SELECT * FROM {T_SUPPLIERS}").fetchdf()
+    rows = conn.execute(SUPPLIER_RISK_SQL).fetchall()
     conn.close()
     results = []
-    for _, r in df.iterrows():
-        lt_score = min(100, max(0, (float(r.get("avg_lead_time_days", 14)) - 5) * 3))
-        otd_score = max(0, (1 - float(r.get("on_time_delivery_rate", 0.9))) * 200)
-        qrr_score = float(r.get("quality_rejection_rate", 0.01)) * 1000
-        risk = round(lt_score * 0.3 + otd_score * 0.4 + qrr_score * 0.3, 1)
-        results.append({"supplier_id": r["supplier_id"], "supplier_name": r["supplier_name"],
-                        "risk_score": risk, "risk_level": "high" if risk > 60 else "medium" if risk > 30 else "low",
-                        "lead_time": r.get("avg_lead_time_days"), "otd_rate": r.get("on_time_delivery_rate"), "qrr": r.get("quality_rejection_rate")})
+    for sid, name, score, lt, otd, qrr in rows:
+        risk = round(score, 1)
+        results.append({"supplier_id": sid, "supplier_name": name, "risk_score": risk,
+                        "risk_level": "high" if risk > 60 else "medium" if risk > 30 else "low",
+                        "lead_time": lt, "otd_rate": otd, "qrr": qrr})
     results.sort(key=lambda x: x["risk_score"], reverse=True)
     return {"suppliers": results}
 
 def handle_supplier_performance(args):
     conn = get_duckdb()
     if not has(conn, T_SUPPLIERS): conn.close(); return {"message": "Upload suppliers data."}
-    df = conn.execute(f"SELECT * FROM {T_SUPPLIERS} ORDER BY on_time_delivery_rate DESC").fetchdf()
+    rows = records(conn.execute(f"SELECT * FROM {T_SUPPLIERS} ORDER BY on_time_delivery_rate DESC"))
     conn.close()
-    return {"suppliers": df.to_dict("records"), "count": len(df)}
+    return {"suppliers": rows, "count": len(rows)}
 
 def handle_supplier_concentration(args):
     conn = get_duckdb()
     if not has(conn, T_PO): conn.close(); return {"message": "Upload purchase_orders data."}
-    df = conn.execute(f"""
+    rows = records(conn.execute(f"""
         SELECT supplier_id, COUNT(*) as orders, SUM(total_po_value) as total_value,
             SUM(total_po_value)*100.0/SUM(SUM(total_po_value)) OVER() as value_pct
         FROM {T_PO} GROUP BY supplier_id ORDER BY total_value DESC
-    """).fetchdf()
+    """))
     conn.close()
-    top_pct = float(df.head(3)["value_pct"].sum()) if len(df) > 0 else 0
-    return {"suppliers": df.to_dict("records"), "top3_value_pct": round(top_pct, 1),
+    top_pct = float(sum(r["value_pct"] or 0 for r in rows[:3])) if len(rows) > 0 else 0
+    return {"suppliers": rows, "top3_value_pct": round(top_pct, 1),
             "concentration_risk": "high" if top_pct > 80 else "medium" if top_pct > 50 else "low"}
 
 def _graph_tool(handler):
@@ -577,20 +754,23 @@ def _graph_tool(handler):
     except Exception as e: return {"message": f"Graph not populated: {str(e)}. Upload supplier/PO data."}
 
 def handle_supplier_network(args):
+    limit, offset = int(args.get("limit", 1000)), int(args.get("offset", 0))
     def _run():
         g = get_graph()
-        r = g.query("MATCH (s:Supplier)-[:SUPPLIES]->(p:Product) RETURN s.supplier_id, s.supplier_name, s.lead_time, p.product_id ORDER BY s.supplier_name")
-        return {"relationships": len(r.result_set), "network": [{"supplier_id": x[0], "supplier_name": x[1], "lead_time": x[2], "product_id": x[3]} for x in r.result_set]}
+        r = g.query("MATCH (s:Supplier)-[:SUPPLIES]->(p:Product) RETURN s.supplier_id, s.supplier_name, s.lead_time, p.product_id ORDER BY s.supplier_name, p.product_id SKIP $offset LIMIT $limit", {"offset": offset, "limit": limit})
+        page = {"relationships": len(r.result_set), "offset": offset, "network": [{"supplier_id": x[0], "supplier_name": x[1], "lead_time": x[2], "product_id": x[3]} for x in r.result_set]}
+        if len(r.result_set) == limit: page["next_offset"] = offset + limit
+        return page
     result = _graph_tool(_run)
-    if "message" in result and has(get_duckdb(), T_SUPPLIERS):
-        conn = get_duckdb(); df = conn.execute(f"SELECT * FROM {T_SUPPLIERS}").fetchdf(); conn.close()
-        return {"note": "Graph not populated, showing DuckDB.", "suppliers": df.to_dict("records")}
+    if "message" in result and has(None, T_SUPPLIERS):
+        conn = get_duckdb(); rows = records(conn.execute(f"SELECT * FROM {T_SUPPLIERS}")); conn.close()
+        return {"note": "Graph not populated, showing DuckDB.", "suppliers": rows}
     return result
 
 def handle_single_source(args):
     def _run():
         g = get_graph()
-        r = g.query(f"MATCH (p:Product)<-[:SUPPLIES]-(s:Supplier) WITH p, COUNT(s) as c, COLLECT(s.supplier_name) as sups WHERE c=1 RETURN p.product_id, sups[0] LIMIT {args.get('limit', 50)}")
+        r = g.query("MATCH (p:Product)<-[:SUPPLIES]-(s:Supplier) WITH p, COUNT(s) as c, COLLECT(s.supplier_name) as sups WHERE c=1 RETURN p.product_id, sups[0] LIMIT $limit", {"limit": int(args.get("limit", 50))})
         return {"total": len(r.result_set), "risks": [{"product_id": x[0], "sole_supplier": x[1], "risk": "high"} for x in r.result_set]}
     return _graph_tool(_run)
 
@@ -598,7 +778,7 @@ def handle_ripple(args):
     sid = args.get("supplier_id", "")
     def _run():
         g = get_graph()
-        r = g.query(f"MATCH (s:Supplier {{supplier_id:'{sid}'}})-[:SUPPLIES]->(p:Product) RETURN s.supplier_name, p.product_id")
+        r = g.query("MATCH (s:Supplier {supplier_id: $sid})-[:SUPPLIES]->(p:Product) RETURN s.supplier_name, p.product_id", {"sid": sid})
         if not r.result_set: return {"message": f"Supplier '{sid}' not found."}
         return {"supplier": r.result_set[0][0], "impacted": [x[1] for x in r.result_set], "count": len(r.result_set),
                 "severity": "high" if len(r.result_set) > 10 else "medium" if len(r.result_set) > 3 else "low"}
@@ -613,19 +793,28 @@ def handle_lead_time_var(args):
     if "message" in result:
         conn = get_duckdb()
         if has(conn, T_SUPPLIERS):
-            df = conn.execute(f"SELECT supplier_id, supplier_name, avg_lead_time_days, risk_score FROM {T_SUPPLIERS} ORDER BY avg_lead_time_days DESC").fetchdf()
-            conn.close(); return {"note": "From DuckDB.", "suppliers": df.to_dict("records")}
+            rows = records(conn.execute(f"SELECT supplier_id, supplier_name, avg_lead_time_days, risk_score FROM {T_SUPPLIERS} ORDER BY avg_lead_time_days DESC"))
+            conn.close(); return {"note": "From DuckDB.", "suppliers": rows}
         conn.close()
     return result
 
+# The SKU's current supplier and the five best-rated others in one round-trip, tagged by branch
+ALTERNATIVES_CYPHER = """
+MATCH (s:Supplier)-[:SUPPLIES]->(:Product {product_id: $sku})
+WITH s LIMIT 1
+RETURN 'current' AS kind, s.supplier_id AS id, s.supplier_name AS name, s.lead_time AS lead_time, NULL AS rating
+UNION ALL
+MATCH (s:Supplier) WHERE NOT (s)-[:SUPPLIES]->({product_id: $sku})
+WITH s ORDER BY s.rating DESC LIMIT 5
+RETURN 'alt' AS kind, s.supplier_id AS id, s.supplier_name AS name, s.lead_time AS lead_time, s.rating AS rating
+"""
+
 def handle_find_alternatives(args):
     sku = args.get("sku", "")
     def _run():
-        g = get_graph()
-        cur = g.query(f"MATCH (s:Supplier)-[:SUPPLIES]->(p:Product {{product_id:'{sku}'}}) RETURN s.supplier_id, s.supplier_name, s.lead_time")
-        current = {"id": cur.result_set[0][0], "name": cur.result_set[0][1], "lead_time": cur.result_set[0][2]} if cur.result_set else None
-        alt = g.query(f"MATCH (s:Supplier) WHERE NOT (s)-[:SUPPLIES]->({{product_id:'{sku}'}}) RETURN s.supplier_id, s.supplier_name, s.lead_time, s.rating ORDER BY s.rating DESC LIMIT 5")
-        return {"product_id": sku, "current": current, "alternatives": [{"id": x[0], "name": x[1], "lead_time": x[2], "rating": x[3]} for x in alt.result_set]}
+        rows = get_graph().query(ALTERNATIVES_CYPHER, {"sku": sku}).result_set
+        current = next(({"id": x[1], "name": x[2], "lead_time": x[3]} for x in rows if x[0] == "current"), None)
+        return {"product_id": sku, "current": current, "alternatives": [{"id": x[1], "name": x[2], "lead_time": x[3], "rating": x[4]} for x in rows if x[0] == "alt"]}
     return _graph_tool(_run)
 
 # ═════════════════════════════════════════════════════════════════════════════
@@ -648,17 +837,23 @@ def handle_schema_info(args):
     conn = get_duckdb()
     t = args.get("table", "sales_transactions")
     if not has(conn, t): conn.close(); return {"message": f"Table '{t}' not uploaded yet. Valid tables: {ALL_TABLES}"}
-    schema = conn.execute(f"DESCRIBE {t}").fetchdf()
-    sample = conn.execute(f"SELECT * FROM {t} LIMIT 5").fetchdf()
+    schema = records(conn.execute(f"DESCRIBE {t}"))
+    sample = records(conn.execute(f"SELECT * FROM {t} LIMIT 5"))
     n = cnt(conn, t); conn.close()
-    return {"table": t, "rows": n, "columns": schema.to_dict("records"), "sample": sample.to_dict("records")}
+    return {"table": t, "rows": n, "columns": schema, "sample": sample}
 
 def handle_run_sql(args):
     sql = args.get("sql", "").strip()
-    for kw in ["INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "TRUNCATE"]:
-        if kw in sql.upper(): return {"error": f"Write operations blocked: {kw}"}
-    conn = get_duckdb(); df = conn.execute(sql).fetchdf(); conn.close()
-    return {"rows": len(df), "columns": list(df.columns), "data": df.head(100).to_dict("records")}
+    # DuckDB's own parser classifies each statement — no false hits on column names or string literals, and
+    # COPY/ATTACH/SET are caught too (the read-only connection alone still lets COPY ... TO write files)
+    for st in duckdb.extract_statements(sql):
+        if st.type != duckdb.StatementType.SELECT: return {"error": f"Write operations blocked: {st.type.name}"}
+    conn = get_duckdb(); cur = conn.execute(sql)
+    cols = [d[0] for d in cur.description]; rows = cur.fetchmany(100); n = len(rows)
+    # The rest is only counted, a chunk at a time, so a huge SELECT never sits in memory whole
+    while chunk := cur.fetchmany(8192): n += len(chunk)
+    conn.close()
+    return {"rows": n, "columns": cols, "data": [dict(zip(cols, r)) for r in rows]}
 
 def handle_version_history(args):
     conn = get_duckdb()
@@ -666,19 +861,16 @@ def handle_version_history(args):
         history = [{"category": t, "rows": cnt(conn, t), "status": "uploaded"} for t in ALL_TABLES if has(conn, t)]
         conn.close()
         return {"history": history} if history else {"message": "No data uploaded yet."}
-    df = conn.execute("SELECT * FROM file_uploads ORDER BY upload_timestamp DESC").fetchdf()
+    rows = records(conn.execute("SELECT * FROM file_uploads ORDER BY upload_timestamp DESC"))
     conn.close()
-    return {"total_uploads": len(df), "history": df.to_dict("records")}
+    return {"total_uploads": len(rows), "history": rows}
 
 def handle_database_refresh(args):
     conn = get_duckdb()
-    report = {"duckdb": {}, "falkordb": {}}
-    for t in ALL_TABLES:
-        if has(conn, t):
-            report["duckdb"][t] = {"status": "ok", "rows": cnt(conn, t), "columns": len(conn.execute(f"DESCRIBE {t}").fetchall())}
-        else:
-            report["duckdb"][t] = {"status": "not_loaded"}
+    # Row and column counts for every table from one catalog query rather than has/cnt/DESCRIBE per table
+    stats = {t: (n, c) for t, n, c in conn.execute("SELECT table_name, estimated_size, column_count FROM duckdb_tables() WHERE schema_name = 'main'").fetchall()}
     conn.close()
+    report = {"duckdb": {t: {"status": "ok", "rows": stats[t][0], "columns": stats[t][1]} if t in stats else {"status": "not_loaded"} for t in ALL_TABLES}, "falkordb": {}}
     try:
         g = get_graph()
         s = g.query("MATCH (s:Supplier) RETURN COUNT(s)").result_set
@@ -744,3 +936,41 @@ TOOL_MAP = {
     "get_shipment_tracking": handle_shipment_tracking,
     "get_product_catalog": handle_product_catalog,
 }
+
+# Read-mostly tools agents re-call within a turn, served from memory for a per-tool TTL. The key includes
+# data_version(), which every committed write to the file changes (re-uploads with the same row count and
+# schema-only changes included), so a write invalidates entries before the TTL runs out. Errors are never
+# cached or papered over — a failed recompute raises like an unmemoized call
+MEMO_TTL = {"get_full_dashboard": 30, "get_supplier_network": 30, "get_kpi_summary": 60, "get_abc_xyz_classification": 60,
+            "get_data_quality_report": 60, "get_schema_info": 60, "list_uploads": 10}
+MEMO_MAX = 128  # entries kept across all tools; least recently used is evicted first
+_memo = OrderedDict()
+_memo_lock = threading.Lock()  # tools run concurrently on worker threads
+
+def data_version():
+    """(mtime, size) of the database file and its WAL — a commit lands in one of them. Two stats, no open"""
+    version = []
+    for path in (DUCKDB_PATH, DUCKDB_PATH + ".wal"):
+        try: st = os.stat(path); version.append((st.st_mtime_ns, st.st_size))
+        except OSError: version.append(None)
+    return tuple(version)
+
+def memoized(name, handler, ttl):
+    def wrapper(args):
+        # Read before the handler runs, so a write landing mid-call files the result under the old version
+        key = ((name, repr(sorted(args.items()))), data_version())
+        with _memo_lock:
+            hit = _memo.get(key)
+            if hit and time.monotonic() - hit[0] < ttl:
+                _memo.move_to_end(key)
+                return hit[1]
+        result = handler(args)
+        with _memo_lock:
+            _memo[key] = (time.monotonic(), result)
+            _memo.move_to_end(key)
+            while len(_memo) > MEMO_MAX:
+                _memo.popitem(last=False)
+        return result
+    return wrapper
+
+for _name, _ttl in MEMO_TTL.items(): TOOL_MAP[_name] = memoized(_name, TOOL_MAP[_name], _ttl)
@@ -65,9 +65,10 @@ def init_duckdb():
     """)
     
     # File metadata tracking
+    conn.execute("CREATE SEQUENCE IF NOT EXISTS file_uploads_seq")
     conn.execute("""
         CREATE TABLE IF NOT EXISTS file_uploads (
-            id INTEGER PRIMARY KEY,
+            id INTEGER PRIMARY KEY DEFAULT nextval('file_uploads_seq'),
             file_category VARCHAR(50),
             filename VARCHAR(255),
             upload_timestamp TIMESTAMP,
@@ -116,6 +117,11 @@ def init_falkordb():
         graph.query("""
             CREATE INDEX ON :Product(sku)
         """)
+
+        # MCP graph tools match products by product_id
+        graph.query("""
+            CREATE INDEX ON :Product(product_id)
+        """)
         
         print(f"✅ FalkorDB initialized at {host}:{port}")
         print("✅ Graph 'supply_chain' ready")
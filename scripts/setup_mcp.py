@@ -20,6 +20,7 @@ import platform
 import shutil
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -27,6 +28,7 @@ from pathlib import Path
 
 MCP_SERVER_NAME = "wc-optimizer"
 CONTAINER_NAME = "wc-optimizer-mcp-sse-1"
+SYSTEM = platform.system()
 
 MCP_CONFIG = {
     "command": "docker",
@@ -86,14 +88,13 @@ def header(msg):
 
 def get_claude_config_path() -> Path | None:
     """Return the Claude Desktop config file path for the current OS."""
-    system = platform.system()
-    if system == "Windows":
+    if SYSTEM == "Windows":
         appdata = os.environ.get("APPDATA")
         if appdata:
             return Path(appdata) / "Claude" / "claude_desktop_config.json"
-    elif system == "Darwin":
+    elif SYSTEM == "Darwin":
         return Path.home() / "Library" / "Application Support" / "Claude" / "claude_desktop_config.json"
-    elif system == "Linux":
+    elif SYSTEM == "Linux":
         # Some Linux users use Claude Desktop via unofficial builds
         xdg = os.environ.get("XDG_CONFIG_HOME", str(Path.home() / ".config"))
         return Path(xdg) / "Claude" / "claude_desktop_config.json"
@@ -102,12 +103,11 @@ def get_claude_config_path() -> Path | None:
 
 def get_cursor_config_path() -> Path | None:
     """Return the Cursor IDE MCP config file path for the current OS."""
-    system = platform.system()
-    if system == "Windows":
+    if SYSTEM == "Windows":
         userprofile = os.environ.get("USERPROFILE")
         if userprofile:
             return Path(userprofile) / ".cursor" / "mcp.json"
-    elif system in ("Darwin", "Linux"):
+    elif SYSTEM in ("Darwin", "Linux"):
         return Path.home() / ".cursor" / "mcp.json"
     return None
 
@@ -118,23 +118,25 @@ def check_docker() -> dict:
     """Check if Docker is available and the MCP container is running."""
     result = {"docker_available": False, "container_running": False}
 
+    # Both probes are independent — run them side by side so a cold Docker daemon costs one timeout, not two
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        version = pool.submit(subprocess.run, ["docker", "--version"], capture_output=True, timeout=10)
+        inspect = pool.submit(
+            subprocess.run,
+            ["docker", "inspect", "--format", "{{.State.Running}}", CONTAINER_NAME],
+            capture_output=True, text=True, timeout=10
+        )
+
     # Check docker CLI
     try:
-        subprocess.run(
-            ["docker", "--version"],
-            capture_output=True, timeout=10
-        )
+        version.result()
         result["docker_available"] = True
     except (FileNotFoundError, subprocess.TimeoutExpired):
         return result
 
     # Check container
     try:
-        proc = subprocess.run(
-            ["docker", "inspect", "--format", "{{.State.Running}}", CONTAINER_NAME],
-            capture_output=True, text=True, timeout=10
-        )
-        result["container_running"] = proc.stdout.strip().lower() == "true"
+        result["container_running"] = inspect.result().stdout.strip().lower() == "true"
     except (FileNotFoundError, subprocess.TimeoutExpired):
         pass
 
@@ -248,7 +250,7 @@ def uninstall_config(path: Path, client_name: str) -> bool:
 def cmd_install():
     """Install MCP config into Claude Desktop and Cursor IDE."""
     header("🔧 WC Optimizer — MCP Auto-Configuration")
-    print(f"  Platform: {platform.system()} {platform.release()}")
+    print(f"  Platform: {SYSTEM} {platform.release()}")
     print()
 
     # Docker check
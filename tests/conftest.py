@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The API imports its packages (routers, services) relative to api/, as uvicorn does with `cd api`;
+# the MCP servers import mcp_servers.* from the repo root, as in their container
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, ROOT)
+
+# No FalkorDB in tests — point at a closed port so startup fails fast and carries on
+os.environ.setdefault("FALKORDB_HOST", "127.0.0.1")
+os.environ.setdefault("FALKORDB_PORT", "1")
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Empty DuckDB file the API opens instead of DUCKDB_PATH"""
+    import main
+    from routers import database
+    from services import duckdb_client
+    from services.query_cache import query_cache
+    path = str(tmp_path / "supply_chain.duckdb")
+    for module in (duckdb_client, main, database):
+        monkeypatch.setattr(module, "DUCKDB_PATH", path)
+    query_cache.clear()  # module-level, and every test app starts at data_version 0
+    return path
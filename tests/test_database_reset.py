@@ -0,0 +1,42 @@
+import duckdb
+from fastapi.testclient import TestClient
+
+import main
+from routers import database
+
+
+def make_tables(db_path):
+    conn = duckdb.connect(db_path)
+    for t in ("inventory", "purchase_orders", "suppliers"):
+        conn.execute(f"CREATE TABLE {t} (id INTEGER)")
+    conn.close()
+
+
+def table_names(db_path):
+    conn = duckdb.connect(db_path)
+    try:
+        return sorted(t[0] for t in conn.execute("SHOW TABLES").fetchall())
+    finally:
+        conn.close()
+
+
+def test_reset_drops_every_table(db_path):
+    make_tables(db_path)
+    with TestClient(main.app) as client:
+        resp = client.post("/api/database/reset")
+        assert resp.status_code == 200
+        assert not client.app.state.tables
+    assert table_names(db_path) == []
+
+
+def test_failed_reset_rolls_back(db_path, monkeypatch):
+    make_tables(db_path)
+    # inventory and purchase_orders drop first; the failing statement must undo them
+    monkeypatch.setitem(database.DROP_SQL, "suppliers", "DROP TABLE no_such_table")
+    with TestClient(main.app) as client:
+        version = client.app.state.data_version
+        resp = client.post("/api/database/reset")
+        assert resp.status_code == 500
+        assert client.app.state.tables == {"inventory", "purchase_orders", "suppliers"}
+        assert client.app.state.data_version == version
+    assert table_names(db_path) == ["inventory", "purchase_orders", "suppliers"]
@@ -0,0 +1,38 @@
+import duckdb
+from fastapi.testclient import TestClient
+
+import main
+from routers import analytics
+
+
+def make_sales(conn):
+    conn.execute("CREATE TABLE sales (date DATE, sku VARCHAR, quantity INTEGER, revenue DOUBLE)")
+    conn.execute("INSERT INTO sales VALUES ('2024-01-01', 'A', 2, 10), ('2024-01-02', 'B', 1, 5)")
+
+
+def test_refresh_builds_rollup_then_classification():
+    conn = duckdb.connect()
+    make_sales(conn)
+    tables = {"sales"}
+    analytics.refresh_derived_tables(conn, tables)
+    assert conn.execute("SELECT COUNT(*) FROM sales_sku_agg").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM abc_xyz_classification").fetchone()[0] == 2
+    assert tables == {"sales"} | analytics.DERIVED_TABLE_NAMES
+
+
+def test_refresh_without_sales_builds_nothing():
+    conn = duckdb.connect()
+    tables = {"suppliers"}
+    analytics.refresh_derived_tables(conn, tables)
+    assert tables == {"suppliers"}
+
+
+def test_status_leaves_out_derived_tables(db_path):
+    conn = duckdb.connect(db_path)
+    make_sales(conn)
+    conn.close()
+    with TestClient(main.app) as client:
+        assert analytics.DERIVED_TABLE_NAMES <= client.app.state.tables  # built at startup
+        duck = client.get("/api/database/status").json()["duckdb"]
+    assert duck["table_names"] == ["sales"]
+    assert duck["tables"] == 1 and duck["total_rows"] == 2
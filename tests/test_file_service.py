@@ -0,0 +1,26 @@
+import io
+
+import pytest
+
+from services.file_service import FileService, count_csv_rows
+
+
+@pytest.mark.parametrize("data, rows", [
+    (b'sku,note\nA,"two\nlines"\nB,x\n', 2),   # quoted embedded newline
+    (b"sku,qty\nA,1\nB,2", 2),                  # no trailing newline
+    (b"sku,qty\nA,1\n\nB,2\n", 2),              # blank line
+    (b"sku,qty\n", 0),
+    (b"", 0),
+])
+def test_count_csv_rows(tmp_path, data, rows):
+    path = tmp_path / "upload.csv"
+    path.write_bytes(data)
+    assert count_csv_rows(str(path)) == rows
+    assert count_csv_rows(io.BytesIO(data)) == rows
+
+
+def test_validate_file_counts_parsed_rows(tmp_path):
+    path = tmp_path / "sales.csv"
+    path.write_bytes(b'date,sku,quantity,revenue\n2024-01-01,A,1,"1,000"\n2024-01-02,"B\nC",2,5')
+    result = FileService(str(tmp_path / "store")).validate_file(str(path), "sales")
+    assert result["valid"] and result["row_count"] == 2
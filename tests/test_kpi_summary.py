@@ -0,0 +1,38 @@
+import duckdb
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_kpi_summary_with_decimal_columns(db_path):
+    """sales/inventory as scripts/init_db.py creates them — revenue and unit_cost are DECIMAL"""
+    conn = duckdb.connect(db_path)
+    conn.execute("CREATE TABLE sales (date DATE, sku VARCHAR, quantity INTEGER, revenue DECIMAL(12,2))")
+    conn.execute("CREATE TABLE inventory (sku VARCHAR, qty_on_hand INTEGER, reorder_point INTEGER, unit_cost DECIMAL(10,2))")
+    conn.execute("INSERT INTO sales VALUES ('2024-01-01', 'A', 2, 100.50), ('2024-01-02', 'A', 1, 99.50)")
+    conn.execute("INSERT INTO inventory VALUES ('A', 10, 5, 20.00)")
+    conn.close()
+
+    with TestClient(main.app) as client:
+        resp = client.get("/api/analytics/kpi/summary")
+
+    assert resp.status_code == 200
+    body = resp.json()
+    # inventory value 200 / daily revenue 100 = 2 days; CCC = DIO + 30-day DSO - 0 DPO
+    assert body["dio"] == 2.0
+    assert body["ccc"] == 32.0
+
+
+def test_kpi_summary_keeps_dso_when_dio_query_fails(db_path):
+    """inventory without unit_cost breaks the DIO query; DSO and CCC must not lose their 30 days"""
+    conn = duckdb.connect(db_path)
+    conn.execute("CREATE TABLE sales (date DATE, sku VARCHAR, quantity INTEGER, revenue DECIMAL(12,2))")
+    conn.execute("CREATE TABLE inventory (sku VARCHAR, qty_on_hand INTEGER, reorder_point INTEGER)")
+    conn.close()
+
+    with TestClient(main.app) as client:
+        body = client.get("/api/analytics/kpi/summary").json()
+
+    assert body["dio"] == 0
+    assert body["dso"] == 30.0 and "dso_note" in body
+    assert body["ccc"] == 30.0
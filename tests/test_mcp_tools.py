@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import duckdb
+import pytest
+
+from mcp_servers import sse_server, tool_handlers
+
+
+@pytest.fixture
+def mcp_db(tmp_path, monkeypatch):
+    """Sales file with one obvious outlier, opened by the MCP handlers instead of DUCKDB_PATH"""
+    path = str(tmp_path / "supply_chain.duckdb")
+    conn = duckdb.connect(path)
+    conn.execute("CREATE TABLE sales_transactions (product_id VARCHAR, qty_sold INTEGER)")
+    conn.execute("INSERT INTO sales_transactions SELECT 'P-' || i, 10 FROM range(20) t(i)")
+    conn.execute("INSERT INTO sales_transactions VALUES ('P-99', 500)")
+    conn.close()
+    monkeypatch.setattr(tool_handlers, "DUCKDB_PATH", path)
+    monkeypatch.setattr(tool_handlers, "_table_stats", (0.0, {}))
+    tool_handlers._memo.clear()
+    return path
+
+
+def call(name, arguments):
+    content = asyncio.run(sse_server.call_tool(name, arguments))
+    return json.loads(content[0].text)
+
+
+def test_detect_anomalies_schema_takes_real_table_names():
+    for tool in sse_server.TOOLS:
+        if tool.name == "detect_anomalies":
+            props = tool.inputSchema["properties"]
+    assert props["table"]["default"] == tool_handlers.T_SALES
+    assert set(props["table"]["enum"]) <= set(tool_handlers.ALL_TABLES)
+    assert sse_server.invalid_args(sse_server.VALIDATORS, "detect_anomalies", {"table": "sales_transactions", "column": "qty_sold"}) is None
+    assert sse_server.invalid_args(sse_server.VALIDATORS, "detect_anomalies", {"table": "sales"})
+
+
+def test_detect_anomalies_dispatch(mcp_db):
+    result = call("detect_anomalies", {"table": "sales_transactions", "column": "qty_sold", "z_threshold": 3})
+    assert result["total_rows"] == 21
+    assert result["anomalies_found"] == 1
+    assert result["anomalies"][0]["product_id"] == "P-99"
+
+
+def test_detect_anomalies_defaults(mcp_db):
+    assert call("detect_anomalies", {})["anomalies_found"] == 1
+
+
+def test_invalid_arguments_are_rejected_before_dispatch(mcp_db):
+    assert call("detect_anomalies", {"table": "sales"})["error"].startswith("Invalid arguments for detect_anomalies")
+
+
+def test_memo_sees_schema_only_change(mcp_db):
+    before = call("get_schema_info", {"table": "sales_transactions"})
+    conn = duckdb.connect(mcp_db)
+    conn.execute("ALTER TABLE sales_transactions ADD COLUMN region VARCHAR")  # same row count
+    conn.close()
+    after = call("get_schema_info", {"table": "sales_transactions"})
+    assert before != after
+    assert "region" in json.dumps(after)
+
+
+def test_both_servers_return_compact_json(mcp_db):
+    from mcp_servers import stdio_server
+    args = {"table": "sales_transactions", "column": "qty_sold"}
+    sse_text = asyncio.run(sse_server.call_tool("detect_anomalies", args))[0].text
+    tool_handlers._memo.clear()
+    stdio_text = asyncio.run(stdio_server.call_tool("detect_anomalies", args))[0].text
+    assert sse_text == stdio_text
+    assert "\n" not in sse_text
+
+
+def test_detect_anomalies_returns_strongest_outliers_first(mcp_db):
+    result = call("detect_anomalies", {"table": "sales_transactions", "column": "qty_sold", "z_threshold": 0})
+    scores = [abs(r["z_score"]) for r in result["anomalies"]]
+    assert result["anomalies_found"] == 21
+    assert scores == sorted(scores, reverse=True)
+    assert result["anomalies"][0]["product_id"] == "P-99"
+    assert result == call("detect_anomalies", {"table": "sales_transactions", "column": "qty_sold", "z_threshold": 0})
+
+
+def test_supplier_risk_score_rounds_final_score_once(mcp_db):
+    conn = duckdb.connect(mcp_db)
+    conn.execute("""CREATE TABLE suppliers AS SELECT * FROM (VALUES
+        ('S-1', 'Halfway', 34.1, 0.892, 0.0244), ('S-2', 'Low', 6.0, 0.99, 0.001))
+        t(supplier_id, supplier_name, avg_lead_time_days, on_time_delivery_rate, quality_rejection_rate)""")
+    conn.close()
+    # 34.1/0.892/0.0244 weighs to a float just under 42.15: Python rounds it to 42.1, SQL ROUND to 42.2
+    score = (34.1 - 5) * 3 * 0.3 + (1 - 0.892) * 200 * 0.4 + 0.0244 * 1000 * 0.3
+    suppliers = tool_handlers.TOOL_MAP["get_supplier_risk_scores"]({})["suppliers"]
+    assert [s["supplier_id"] for s in suppliers] == ["S-1", "S-2"]
+    assert suppliers[0]["risk_score"] == round(score, 1) == 42.1
+    assert suppliers[0]["risk_level"] == "medium"
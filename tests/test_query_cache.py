@@ -0,0 +1,19 @@
+from services.query_cache import QueryCache
+
+
+def test_evicts_least_recently_used():
+    cache = QueryCache(maxsize=2)
+    cache.set("a", 1, 0)
+    cache.set("b", 2, 0)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3, 0)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_new_data_version_drops_old_entries():
+    cache = QueryCache()
+    cache.set(("kpi", (), 0), "old", 0)
+    cache.set(("abc", (), 1), "new", 1)
+    assert cache.get(("kpi", (), 0)) is None
+    assert len(cache._store) == 1
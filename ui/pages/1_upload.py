@@ -1,7 +1,15 @@
 import streamlit as st
 import pandas as pd
-import requests
+import httpx
 import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Upload cache keys need speed, not cryptographic strength — xxh3 when installed, blake2b otherwise
+try:
+    from xxhash import xxh3_128_hexdigest as content_digest
+except ImportError:
+    def content_digest(data): return hashlib.blake2b(data, digest_size=16).hexdigest()
 
 st.set_page_config(page_title="Upload Data", page_icon="📤")
 
@@ -10,77 +18,164 @@ st.subheader("Upload your 9 supply chain dataset files")
 
 API_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
 
+# The UI only checks and previews an upload — the full file is parsed by the API
+def first_sheet(uploaded_file):
+    """Read-only workbook and its first sheet (the one pd.read_excel reads)"""
+    from openpyxl import load_workbook
+    uploaded_file.seek(0)
+    wb = load_workbook(uploaded_file, read_only=True, data_only=True)
+    return wb, wb.worksheets[0]
+
+def header_columns(uploaded_file):
+    """Column names from the header row alone — all the schema check needs"""
+    if uploaded_file.name.endswith('.csv'):
+        uploaded_file.seek(0)
+        return list(pd.read_csv(uploaded_file, nrows=0).columns)
+    wb, ws = first_sheet(uploaded_file)
+    header = next(ws.iter_rows(max_row=1, values_only=True), ())
+    wb.close()
+    return list(header)
+
+def row_count(uploaded_file):
+    """Data rows: streamed CSV parse of the first column, sheet dimension for xlsx"""
+    if uploaded_file.name.endswith('.csv'):
+        # Same rows the API's count_csv_rows reports — quoted newlines and blank lines handled by the parser
+        uploaded_file.seek(0)
+        try:
+            return sum(len(c) for c in pd.read_csv(uploaded_file, usecols=[0], dtype=str, chunksize=100_000))
+        except pd.errors.EmptyDataError:
+            return 0
+    wb, ws = first_sheet(uploaded_file)
+    rows = ws.max_row - 1 if ws.max_row else sum(1 for _ in ws.iter_rows(min_row=2))
+    wb.close()
+    return rows
+
+def preview(uploaded_file, n=3):
+    """First n data rows"""
+    if uploaded_file.name.endswith('.csv'):
+        uploaded_file.seek(0)
+        return pd.read_csv(uploaded_file, nrows=n)
+    wb, ws = first_sheet(uploaded_file)
+    it = ws.iter_rows(max_row=n + 1, values_only=True)
+    header = next(it, ())
+    head = pd.DataFrame(list(it), columns=header)
+    wb.close()
+    return head
+
+# Keyed on a content digest; the leading underscore keeps Streamlit from hashing the file itself
+@st.cache_data(show_spinner=False, max_entries=64)
+def inspect_upload(name, digest, _uploaded_file):
+    """Header columns and row count, computed once per distinct upload — later reruns hit the cache"""
+    return header_columns(_uploaded_file), row_count(_uploaded_file)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_preview(name, digest, _uploaded_file):
+    return preview(_uploaded_file)
+
+# One keep-alive client per server process for every API call — httpx.Client is safe to share
+# across sessions and the Upload-all threads, so each call reuses a pooled connection
+@st.cache_resource
+def api_client():
+    return httpx.Client(limits=httpx.Limits(max_connections=10, max_keepalive_connections=4))
+
+def post_upload(client, slot_key, uploaded_file):
+    """POST one file to the API — httpx streams the file part in 64 KB reads, no in-memory multipart body.
+
+    Takes the client rather than calling api_client(): st.cache_resource needs the script thread's
+    context, and the Upload-all workers don't have one.
+    """
+    uploaded_file.seek(0)
+    files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type or "application/octet-stream")}
+    return client.post(f"{API_URL}/api/files/upload?category={slot_key}", files=files, timeout=60)
+
+# Status is re-read at most every 10s rather than on every rerun; uploads, reset and Refresh clear it
+@st.cache_data(ttl=10, show_spinner=False)
+def db_status(api_url):
+    try:
+        resp = api_client().get(f"{api_url}/api/database/status", timeout=5)
+        return resp.json() if resp.status_code == 200 else {}
+    except:
+        return {}
+
 # ── All 9 dataset slots matching DATASETS.md ─────────────────────────────────
-FILE_SLOTS = {
-    "products": {
-        "icon": "🏷️", "name": "Products",
-        "required_cols": ["product_id", "product_name", "unit_cost", "unit_price"],
-        "optional_cols": ["category", "subcategory", "supplier_id", "lead_time_days", "abc_class", "xyz_class", "reorder_point", "economic_order_qty", "safety_stock_target"],
-        "destination": "DuckDB",
-        "description": "Master product catalog (200 SKUs)"
-    },
-    "customers": {
-        "icon": "👥", "name": "Customers",
-        "required_cols": ["customer_id", "customer_name"],
-        "optional_cols": ["segment", "region", "state", "credit_limit", "contracted_payment_days", "risk_score", "ytd_revenue", "avg_days_to_pay"],
-        "destination": "DuckDB",
-        "description": "Customer master with credit profiles"
-    },
-    "suppliers": {
-        "icon": "🏭", "name": "Suppliers",
-        "required_cols": ["supplier_id", "supplier_name"],
-        "optional_cols": ["category", "segment", "country", "contracted_payment_days", "avg_lead_time_days", "on_time_delivery_rate", "quality_rejection_rate", "risk_score", "annual_spend"],
-        "destination": "DuckDB + FalkorDB",
-        "description": "Supplier master with performance metrics"
-    },
-    "inventory_snapshot": {
-        "icon": "📦", "name": "Inventory Snapshot",
-        "required_cols": ["product_id", "qty_on_hand"],
-        "optional_cols": ["snapshot_date", "location_id", "qty_in_transit", "qty_committed", "qty_available", "safety_stock_target", "reorder_point", "days_of_supply", "unit_cost", "inventory_value", "stock_status", "days_since_last_movement"],
-        "destination": "DuckDB",
-        "description": "Daily inventory positions per SKU per location"
-    },
-    "sales_transactions": {
-        "icon": "💰", "name": "Sales Transactions",
-        "required_cols": ["transaction_date", "product_id", "qty_sold", "total_revenue"],
-        "optional_cols": ["transaction_id", "customer_id", "location_id", "unit_price", "unit_cost", "total_cost", "gross_profit", "profit_margin", "channel", "is_promotional", "invoice_id"],
-        "destination": "DuckDB",
-        "description": "Individual sales (~50K transactions)"
-    },
-    "purchase_orders": {
-        "icon": "📝", "name": "Purchase Orders",
-        "required_cols": ["po_id", "supplier_id", "product_id", "qty_ordered"],
-        "optional_cols": ["po_date", "location_id", "qty_received", "unit_cost", "total_po_value", "expected_delivery_date", "actual_delivery_date", "po_status", "delay_days", "invoice_id"],
-        "destination": "DuckDB + FalkorDB",
-        "description": "Replenishment POs to suppliers (~2K)"
-    },
-    "ar_ledger": {
-        "icon": "📨", "name": "AR Ledger",
-        "required_cols": ["invoice_id", "customer_id", "invoice_amount"],
-        "optional_cols": ["transaction_id", "invoice_date", "due_date", "paid_amount", "paid_date", "days_to_pay", "is_overdue", "days_overdue", "aging_bucket", "dispute_flag", "write_off_flag"],
-        "destination": "DuckDB",
-        "description": "Accounts Receivable — for DSO calculation"
-    },
-    "ap_ledger": {
-        "icon": "📤", "name": "AP Ledger",
-        "required_cols": ["invoice_id", "supplier_id", "invoice_amount"],
-        "optional_cols": ["po_id", "invoice_date", "due_date", "paid_amount", "paid_date", "contracted_days", "actual_days_to_pay", "early_payment_discount", "payment_status", "dpo_contribution"],
-        "destination": "DuckDB",
-        "description": "Accounts Payable — for DPO calculation"
-    },
-    "shipments": {
-        "icon": "🚚", "name": "Shipments",
-        "required_cols": ["shipment_id", "po_id", "supplier_id"],
-        "optional_cols": ["product_id", "origin_location", "destination_location_id", "ship_date", "expected_arrival_date", "actual_arrival_date", "qty_shipped", "freight_cost", "carrier", "tracking_number", "status", "delay_days"],
-        "destination": "DuckDB",
-        "description": "In-transit tracking for supplier shipments"
+# Shared, read-only slot table with each slot's CSV template header (as bytes) — built once per server
+# process instead of on every rerun (cache_resource hands back the same object, no copy)
+@st.cache_resource
+def file_slots():
+    slots = {
+        "products": {
+            "icon": "🏷️", "name": "Products",
+            "required_cols": ["product_id", "product_name", "unit_cost", "unit_price"],
+            "optional_cols": ["category", "subcategory", "supplier_id", "lead_time_days", "abc_class", "xyz_class", "reorder_point", "economic_order_qty", "safety_stock_target"],
+            "destination": "DuckDB",
+            "description": "Master product catalog (200 SKUs)"
+        },
+        "customers": {
+            "icon": "👥", "name": "Customers",
+            "required_cols": ["customer_id", "customer_name"],
+            "optional_cols": ["segment", "region", "state", "credit_limit", "contracted_payment_days", "risk_score", "ytd_revenue", "avg_days_to_pay"],
+            "destination": "DuckDB",
+            "description": "Customer master with credit profiles"
+        },
+        "suppliers": {
+            "icon": "🏭", "name": "Suppliers",
+            "required_cols": ["supplier_id", "supplier_name"],
+            "optional_cols": ["category", "segment", "country", "contracted_payment_days", "avg_lead_time_days", "on_time_delivery_rate", "quality_rejection_rate", "risk_score", "annual_spend"],
+            "destination": "DuckDB + FalkorDB",
+            "description": "Supplier master with performance metrics"
+        },
+        "inventory_snapshot": {
+            "icon": "📦", "name": "Inventory Snapshot",
+            "required_cols": ["product_id", "qty_on_hand"],
+            "optional_cols": ["snapshot_date", "location_id", "qty_in_transit", "qty_committed", "qty_available", "safety_stock_target", "reorder_point", "days_of_supply", "unit_cost", "inventory_value", "stock_status", "days_since_last_movement"],
+            "destination": "DuckDB",
+            "description": "Daily inventory positions per SKU per location"
+        },
+        "sales_transactions": {
+            "icon": "💰", "name": "Sales Transactions",
+            "required_cols": ["transaction_date", "product_id", "qty_sold", "total_revenue"],
+            "optional_cols": ["transaction_id", "customer_id", "location_id", "unit_price", "unit_cost", "total_cost", "gross_profit", "profit_margin", "channel", "is_promotional", "invoice_id"],
+            "destination": "DuckDB",
+            "description": "Individual sales (~50K transactions)"
+        },
+        "purchase_orders": {
+            "icon": "📝", "name": "Purchase Orders",
+            "required_cols": ["po_id", "supplier_id", "product_id", "qty_ordered"],
+            "optional_cols": ["po_date", "location_id", "qty_received", "unit_cost", "total_po_value", "expected_delivery_date", "actual_delivery_date", "po_status", "delay_days", "invoice_id"],
+            "destination": "DuckDB + FalkorDB",
+            "description": "Replenishment POs to suppliers (~2K)"
+        },
+        "ar_ledger": {
+            "icon": "📨", "name": "AR Ledger",
+            "required_cols": ["invoice_id", "customer_id", "invoice_amount"],
+            "optional_cols": ["transaction_id", "invoice_date", "due_date", "paid_amount", "paid_date", "days_to_pay", "is_overdue", "days_overdue", "aging_bucket", "dispute_flag", "write_off_flag"],
+            "destination": "DuckDB",
+            "description": "Accounts Receivable — for DSO calculation"
+        },
+        "ap_ledger": {
+            "icon": "📤", "name": "AP Ledger",
+            "required_cols": ["invoice_id", "supplier_id", "invoice_amount"],
+            "optional_cols": ["po_id", "invoice_date", "due_date", "paid_amount", "paid_date", "contracted_days", "actual_days_to_pay", "early_payment_discount", "payment_status", "dpo_contribution"],
+            "destination": "DuckDB",
+            "description": "Accounts Payable — for DPO calculation"
+        },
+        "shipments": {
+            "icon": "🚚", "name": "Shipments",
+            "required_cols": ["shipment_id", "po_id", "supplier_id"],
+            "optional_cols": ["product_id", "origin_location", "destination_location_id", "ship_date", "expected_arrival_date", "actual_arrival_date", "qty_shipped", "freight_cost", "carrier", "tracking_number", "status", "delay_days"],
+            "destination": "DuckDB",
+            "description": "In-transit tracking for supplier shipments"
+        }
     }
-}
+    for info in slots.values():
+        info["template"] = (",".join(info['required_cols'] + info['optional_cols']) + "\n").encode()
+    return slots
+
+FILE_SLOTS = file_slots()
 
 # Session state
 for k in FILE_SLOTS:
-    if f"uploaded_{k}" not in st.session_state:
-        st.session_state[f"uploaded_{k}"] = False
+    st.session_state.setdefault(f"uploaded_{k}", False)
 
 st.markdown("---")
 
@@ -88,69 +183,111 @@ st.markdown("---")
 st.info("💡 **CCC Engine:** Upload inventory_snapshot + ar_ledger + ap_ledger to enable full Cash Conversion Cycle analysis")
 
 # ── Upload cards ──────────────────────────────────────────────────────────────
-cols = st.columns(3)
+def inspect(uploaded_file):
+    """Content digest plus cached header columns and row count"""
+    digest = content_digest(uploaded_file.getbuffer())
+    return (digest, *inspect_upload(uploaded_file.name, digest, uploaded_file))
 
-for idx, (slot_key, info) in enumerate(FILE_SLOTS.items()):
-    with cols[idx % 3]:
-        with st.container(border=True):
-            st.subheader(f"{info['icon']} {info['name']}")
-            st.caption(info['description'])
+def pending_uploads():
+    """Schema-valid files not uploaded yet, read from widget state so card-only reruns are reflected"""
+    pending = {}
+    for k, info in FILE_SLOTS.items():
+        f = st.session_state.get(f"upload_{k}")
+        if f is None or st.session_state[f"uploaded_{k}"]: continue
+        try:
+            if set(info['required_cols']) <= set(inspect(f)[1]): pending[k] = f
+        except Exception:
+            pass  # the card shows the parse error
+    return pending
 
-            if st.session_state[f"uploaded_{slot_key}"]:
-                st.success("✅ Uploaded")
-            else:
-                st.info("📭 Waiting")
+@st.fragment
+def upload_card(slot_key, info):
+    """One slot — a fragment, so picking or previewing a file reruns this card instead of the page"""
+    with st.container(border=True):
+        st.subheader(f"{info['icon']} {info['name']}")
+        st.caption(info['description'])
 
-            uploaded_file = st.file_uploader(
-                f"Upload {info['name']}", type=['csv', 'xlsx'],
-                key=f"upload_{slot_key}", label_visibility="collapsed"
-            )
+        if st.session_state[f"uploaded_{slot_key}"]:
+            st.success("✅ Uploaded")
+        else:
+            st.info("📭 Waiting")
 
-            if uploaded_file:
-                try:
-                    df = pd.read_csv(uploaded_file) if uploaded_file.name.endswith('.csv') else pd.read_excel(uploaded_file)
-                    st.success(f"✅ {len(df):,} rows × {len(df.columns)} cols")
+        uploaded_file = st.file_uploader(
+            f"Upload {info['name']}", type=['csv', 'xlsx'],
+            key=f"upload_{slot_key}", label_visibility="collapsed"
+        )
+
+        if uploaded_file:
+            try:
+                digest, columns, n_rows = inspect(uploaded_file)
+                st.success(f"✅ {n_rows:,} rows × {len(columns)} cols")
+
+                missing = set(info['required_cols']) - set(columns)
+                if missing:
+                    st.error(f"❌ Missing: {', '.join(missing)}")
+                else:
+                    st.success("✅ Schema valid")
+
+                # An expander runs its body even when collapsed — only parse sample rows on request
+                if st.checkbox("Preview first 3 rows", key=f"prev_{slot_key}"):
+                    st.dataframe(cached_preview(uploaded_file.name, digest, uploaded_file), use_container_width=True)
+
+                if st.button("✓ Upload", key=f"confirm_{slot_key}"):
+                    with st.spinner("Uploading..."):
+                        try:
+                            resp = post_upload(api_client(), slot_key, uploaded_file)
+                            if resp.status_code == 200:
+                                st.session_state[f"uploaded_{slot_key}"] = True
+                                db_status.clear()
+                                st.success(f"✅ Saved to {info['destination']}")
+                                st.balloons(); st.rerun()  # full-page rerun: status and other cards
+                            else:
+                                st.error(f"❌ {resp.text}")
+                        except Exception as e:
+                            st.error(f"❌ {e}")
+            except Exception as e:
+                st.error(f"Error: {e}")
+
+        st.download_button(
+            "⬇️ Template", data=info['template'],
+            file_name=f"{slot_key}_template.csv", mime="text/csv", key=f"tpl_{slot_key}"
+        )
+
+cols = st.columns(3)
+for idx, (slot_key, info) in enumerate(FILE_SLOTS.items()):
+    with cols[idx % 3]:
+        upload_card(slot_key, info)
 
-                    missing = set(info['required_cols']) - set(df.columns)
-                    if missing:
-                        st.error(f"❌ Missing: {', '.join(missing)}")
+# ── Upload all pending ────────────────────────────────────────────────────────
+# One click instead of one rerun per card; uploads are I/O-bound and the API serializes its writes.
+# Always shown — card reruns don't redraw it, so what's pending is worked out on click
+if st.button("⬆️ Upload all pending", type="primary", key="upload_all"):
+    pending = pending_uploads()
+    if not pending:
+        st.info("No schema-valid files waiting to upload.")
+    else:
+        with st.spinner("Uploading..."):
+            client = api_client()  # resolved here, on the script thread
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                futures = {k: pool.submit(post_upload, client, k, f) for k, f in pending.items()}
+            for k, fut in futures.items():
+                try:
+                    resp = fut.result()
+                    if resp.status_code == 200:
+                        st.session_state[f"uploaded_{k}"] = True
                     else:
-                        st.success("✅ Schema valid")
-
-                    with st.expander("Preview"):
-                        st.dataframe(df.head(3), use_container_width=True)
-
-                    if st.button("✓ Upload", key=f"confirm_{slot_key}"):
-                        with st.spinner("Uploading..."):
-                            try:
-                                uploaded_file.seek(0)
-                                files = {"file": (uploaded_file.name, uploaded_file.getvalue())}
-                                resp = requests.post(f"{API_URL}/api/files/upload?category={slot_key}", files=files, timeout=60)
-                                if resp.status_code == 200:
-                                    st.session_state[f"uploaded_{slot_key}"] = True
-                                    st.success(f"✅ Saved to {info['destination']}")
-                                    st.balloons(); st.rerun()
-                                else:
-                                    st.error(f"❌ {resp.text}")
-                            except Exception as e:
-                                st.error(f"❌ {e}")
+                        st.error(f"❌ {FILE_SLOTS[k]['name']}: {resp.text}")
                 except Exception as e:
-                    st.error(f"Error: {e}")
-
-            st.download_button(
-                "⬇️ Template", data=",".join(info['required_cols'] + info['optional_cols']),
-                file_name=f"{slot_key}_template.csv", mime="text/csv", key=f"tpl_{slot_key}"
-            )
+                    st.error(f"❌ {FILE_SLOTS[k]['name']}: {e}")
+        db_status.clear()
+        if all(st.session_state[f"uploaded_{k}"] for k in pending):
+            st.balloons(); st.rerun()
 
 # ── Database status ───────────────────────────────────────────────────────────
 st.markdown("---")
 st.subheader("📊 Database Status")
 
-try:
-    resp = requests.get(f"{API_URL}/api/database/status", timeout=5)
-    status = resp.json() if resp.status_code == 200 else {}
-except:
-    status = {}
+status = db_status(API_URL)
 
 col1, col2 = st.columns(2)
 with col1:
@@ -170,6 +307,7 @@ with col2:
 col_a, col_b, col_c = st.columns(3)
 with col_a:
     if st.button("🔄 Refresh Status"):
+        db_status.clear()
         st.rerun()
 
 with col_c:
@@ -186,12 +324,13 @@ with st.expander("⚠️ Reset All Data", expanded=False):
         if st.button("🗑️ Reset All Data Now", type="primary"):
             with st.spinner("Wiping all data..."):
                 try:
-                    resp = requests.post(f"{API_URL}/api/database/reset", timeout=15)
+                    resp = api_client().post(f"{API_URL}/api/database/reset", timeout=15)
                     if resp.status_code == 200:
                         result = resp.json()
                         # Clear upload tracking in session state
                         for k in FILE_SLOTS:
                             st.session_state[f"uploaded_{k}"] = False
+                        db_status.clear()
                         st.success("✅ " + result.get("message", "All data wiped!"))
                         st.json(result.get("details", {}))
                         st.rerun()
@@ -3,6 +3,27 @@ import json
 
 st.set_page_config(page_title="Setup & Instructions", page_icon="📖", layout="wide")
 
+# Built, serialized and encoded once per server process, not on every rerun — the text feeds
+# st.code, the bytes feed both download buttons
+@st.cache_data
+def mcp_config_json():
+    mcp_config = {
+        "mcpServers": {
+            "wc-optimizer": {
+                "command": "docker",
+                "args": [
+                    "exec",
+                    "-i",
+                    "wc-optimizer-mcp-sse-1",
+                    "python3",
+                    "/app/mcp_servers/stdio_server.py"
+                ]
+            }
+        }
+    }
+    text = json.dumps(mcp_config, indent=2)
+    return text, text.encode()
+
 st.title("📖 AI Integration Setup")
 st.markdown("Connect **Claude Desktop** or **Cursor IDE** to query your supply chain data in plain English.")
 
@@ -48,21 +69,7 @@ with st.expander("📋 Manual Setup (if you prefer to configure by hand)", expan
         "It connects via `docker exec` — **no Node.js, no npm packages needed.**"
     )
 
-    mcp_config = {
-        "mcpServers": {
-            "wc-optimizer": {
-                "command": "docker",
-                "args": [
-                    "exec",
-                    "-i",
-                    "wc-optimizer-mcp-sse-1",
-                    "python3",
-                    "/app/mcp_servers/stdio_server.py"
-                ]
-            }
-        }
-    }
-    config_json = json.dumps(mcp_config, indent=2)
+    config_json, config_bytes = mcp_config_json()
 
     st.code(config_json, language="json")
 
@@ -70,7 +77,7 @@ with st.expander("📋 Manual Setup (if you prefer to configure by hand)", expan
     with col_dl1:
         st.download_button(
             label="⬇️ claude_desktop_config.json",
-            data=config_json,
+            data=config_bytes,
             file_name="claude_desktop_config.json",
             mime="application/json",
             use_container_width=True,
@@ -78,7 +85,7 @@ with st.expander("📋 Manual Setup (if you prefer to configure by hand)", expan
     with col_dl2:
         st.download_button(
             label="⬇️ cursor_mcp.json",
-            data=config_json,
+            data=config_bytes,
             file_name="cursor_mcp.json",
             mime="application/json",
             use_container_width=True,
@@ -147,8 +154,8 @@ q_col1, q_col2, q_col3 = st.columns(3)
 
 with q_col1:
     with st.container(border=True):
-        st.markdown("**📦 Inventory**")
-        st.markdown("""
+        st.markdown("""**📦 Inventory**
+
 - *Which SKUs need reordering?*
 - *Find dead stock older than 90 days*
 - *Show overstock tying up cash*
@@ -159,8 +166,8 @@ with q_col1:
 
 with q_col2:
     with st.container(border=True):
-        st.markdown("**💰 Cash & CCC**")
-        st.markdown("""
+        st.markdown("""**💰 Cash & CCC**
+
 - *What is my Cash Conversion Cycle?*
 - *How much cash is trapped in inventory?*
 - *If I cut DIO by 10 days, what's freed?*
@@ -171,8 +178,8 @@ with q_col2:
 
 with q_col3:
     with st.container(border=True):
-        st.markdown("**🏭 Suppliers & Data**")
-        st.markdown("""
+        st.markdown("""**🏭 Suppliers & Data**
+
 - *Which suppliers have the highest risk?*
 - *Find single-source products*
 - *What if Supplier X fails?*
@@ -184,14 +191,20 @@ with q_col3:
 # ─── Available Tools ──────────────────────────────────────────────────────────
 st.markdown("---")
 with st.expander("🛠️ All 42 Available Tools", expanded=False):
+    # One markdown element per column — each section heading and its fenced tool list
     t1, t2, t3 = st.columns(3)
 
     with t1:
-        st.markdown("**Dashboard & Overview**")
-        st.code("get_full_dashboard\nget_kpi_summary\nget_data_quality_report", language="text")
+        st.markdown("""**Dashboard & Overview**
+```text
+get_full_dashboard
+get_kpi_summary
+get_data_quality_report
+```
 
-        st.markdown("**Inventory (10)**")
-        st.code("""get_reorder_alerts
+**Inventory (10)**
+```text
+get_reorder_alerts
 get_smart_reorder_recommendations
 calculate_safety_stock
 calculate_eoq
@@ -200,48 +213,59 @@ get_inventory_aging
 get_dead_stock
 get_overstock_analysis
 get_stockout_risk
-get_abc_xyz_classification""", language="text")
+get_abc_xyz_classification
+```""")
 
     with t2:
-        st.markdown("**Cash Cycle & WC (4)**")
-        st.code("""simulate_ccc_improvement
+        st.markdown("""**Cash Cycle & WC (4)**
+```text
+simulate_ccc_improvement
 get_working_capital_summary
 get_carrying_cost_analysis
-get_pareto_analysis""", language="text")
+get_pareto_analysis
+```
 
-        st.markdown("**Demand & Sales (7)**")
-        st.code("""forecast_demand
+**Demand & Sales (7)**
+```text
+forecast_demand
 detect_anomalies
 get_revenue_trends
 get_sales_velocity
 get_top_skus
 get_customer_concentration
-get_seasonality_analysis""", language="text")
+get_seasonality_analysis
+```""")
 
     with t3:
-        st.markdown("**Supplier Risk & Graph (8)**")
-        st.code("""get_supplier_risk_scores
+        st.markdown("""**Supplier Risk & Graph (8)**
+```text
+get_supplier_risk_scores
 get_supplier_performance
 get_supplier_concentration
 get_supplier_network
 find_single_source_risks
 ripple_effect_analysis
 get_lead_time_variability
-find_alternative_suppliers""", language="text")
+find_alternative_suppliers
+```
 
-        st.markdown("**AR/AP & Cash Flow (5)**")
-        st.code("""get_ar_aging
+**AR/AP & Cash Flow (5)**
+```text
+get_ar_aging
 get_dso_analysis
 get_dpo_analysis
 get_shipment_tracking
-get_product_catalog""", language="text")
+get_product_catalog
+```
 
-        st.markdown("**Data & Admin (5)**")
-        st.code("""list_uploads
+**Data & Admin (5)**
+```text
+list_uploads
 get_schema_info
 run_sql_query
 get_version_history
-trigger_database_refresh""", language="text")
+trigger_database_refresh
+```""")
 
 # ─── Troubleshooting ──────────────────────────────────────────────────────────
 st.markdown("---")